@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# Benchmark of utils.redact against the previous recursive implementation.
+#
+#   python scripts/bench_redact.py [snapshot.json] [--repeat N]
+#
+# Without a snapshot, processes, netconns (detailed), mounts and users are
+# collected from this machine. Both implementations must produce the same output for
+# the key rules; the content scanner used by --redact is timed on its own.
+
+import argparse
+import copy
+import json
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "syssnap"))
+
+from utils.diff import load_snapshot  # noqa: E402
+from utils.redact import ANONYMIZE_KEYS, SENSITIVE_KEYS, Redactor  # noqa: E402
+
+
+def legacy_redact(snapshot, redact=True, anonymize=False):
+    def recursive_redact(d):
+        if isinstance(d, dict):
+            return {
+                k: (
+                    "[REDACTED]"
+                    if redact and any(s in k.lower() for s in SENSITIVE_KEYS)
+                    else (
+                        "[ANONYMIZED]"
+                        if anonymize and any(a in k.lower() for a in ANONYMIZE_KEYS)
+                        else recursive_redact(v)
+                    )
+                )
+                for k, v in d.items()
+            }
+        elif isinstance(d, list):
+            return [recursive_redact(x) for x in d]
+        elif isinstance(d, str) and anonymize:
+            d = re.sub(r"\b(?:\d{1,3}\.){3}\d{1,3}\b", "[ANONYMIZED_IP]", d)
+            d = re.sub(
+                r"\b[a-fA-F0-9]{2}(?::[a-fA-F0-9]{2}){5}\b", "[ANONYMIZED_MAC]", d
+            )
+            return d
+        return d
+
+    return recursive_redact(snapshot)
+
+
+def live_snapshot():
+    from collectors import mounts, netconns, processes, users
+
+    return {
+        "processes": processes.collect(),
+        "netconns": netconns.collect(detail=True),
+        "mounts": mounts.collect(),
+        "users": users.collect(),
+    }
+
+
+def best_of(repeat, fn, snapshot, copies):
+    best = float("inf")
+    for _ in range(repeat):
+        data = copy.deepcopy(snapshot) if copies else snapshot
+        started = time.perf_counter()
+        fn(data)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("snapshot", nargs="?")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    snapshot = load_snapshot(args.snapshot) if args.snapshot else live_snapshot()
+    size = len(json.dumps(snapshot))
+    print(f"snapshot: {size / 1e6:.1f} MB of JSON")
+    for redact, anonymize in ((True, False), (True, True)):
+        redactor = Redactor(redact, anonymize, scan=False)
+        expected = legacy_redact(snapshot, redact, anonymize)
+        # Sections are redacted one by one, as the CLI writes them
+        sections = {
+            name: redactor.section(name, data)
+            for name, data in copy.deepcopy(snapshot).items()
+        }
+        if sections != expected:
+            sys.exit(f"output differs (redact={redact}, anonymize={anonymize})")
+        if anonymize and "users" in snapshot and expected["users"] != "[ANONYMIZED]":
+            sys.exit("users section was not anonymized")
+        old = best_of(
+            args.repeat, lambda d: legacy_redact(d, redact, anonymize), snapshot, False
+        )
+        new = best_of(args.repeat, redactor.apply, snapshot, True)
+        label = "redact+anonymize" if anonymize else "redact"
+        print(
+            f"{label:>17}: legacy {old * 1000:8.1f} ms   "
+            f"new {new * 1000:8.1f} ms   {old / new:4.1f}x"
+        )
+    scanner = Redactor(True, False)
+    scan = best_of(args.repeat, scanner.apply, snapshot, True)
+    hits = ", ".join(f"{k}={v}" for k, v in scanner.scanner.hits.items() if v)
+    print(f"{'redact+scan':>17}: {scan * 1000:8.1f} ms   hits: {hits or 'none'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# Regression check for the structural snapshot diff.
+#
+#   python scripts/check_diff.py
+#
+# Each case is (old, new, expected changes as (op, path) pairs). LOAD_CASES
+# are file contents and the snapshot load_snapshot should read from them
+# (None when it must raise ValueError).
+
+import json
+import os
+import sys
+import tempfile
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "syssnap")
+)
+
+from utils.diff import load_snapshot, structural_diff  # noqa: E402
+
+CASES = [
+    # hash(-1) == hash(-2) in CPython
+    ({"a": {"x": -1}}, {"a": {"x": -2}}, [("changed", "a.x")]),
+    ({"a": [-1, 5]}, {"a": [-2, 5]}, [("changed", "a[0]")]),
+    ({"a": 1}, {"a": 1.0}, [("changed", "a")]),
+    ({"a": {"x": 1, "y": 2}}, {"a": {"y": 2, "x": 1}}, []),
+    ({"a": [1, 2]}, {"a": [1]}, [("removed", "a[1]")]),
+    (
+        {"processes": {"processes": [{"pid": 1, "cmd": "a"}, {"pid": 2}]}},
+        {"processes": {"processes": [{"pid": 2}, {"pid": 1, "cmd": "b"}]}},
+        [("changed", "processes.processes[pid=1].cmd")],
+    ),
+    ({"hardware": {"_cache": {"age": 1}}}, {"hardware": {"_cache": {"age": 2}}}, []),
+]
+
+LOAD_CASES = [
+    ('{"cpu": {"count": 4}}', {"cpu": {"count": 4}}),
+    ('{"section": "cpu", "data": {"count": 4}}\n', {"cpu": {"count": 4}}),
+    (
+        '{"section": "cpu", "data": 1}\n{"section": "users", "data": []}\n',
+        {"cpu": 1, "users": []},
+    ),
+    ('{"section": "cpu", "data": 1}\n{"data": 2}\n', None),
+    ('{"section": "cpu", "data": 1}\n[1, 2]\n', None),
+]
+
+
+def check_load(text, expected):
+    with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as f:
+        f.write(text)
+    try:
+        return load_snapshot(f.name) == expected
+    except ValueError:
+        return expected is None
+    finally:
+        os.remove(f.name)
+
+
+def main():
+    failures = 0
+    for old, new, expected in CASES:
+        changes = [(c["op"], c["path"]) for c in structural_diff(old, new)]
+        if changes != expected:
+            failures += 1
+            print(f"FAIL: {old} -> {new}: expected {expected}, got {changes}")
+    for text, expected in LOAD_CASES:
+        if not check_load(text, expected):
+            failures += 1
+            print(f"FAIL: loading {json.dumps(text)}: expected {expected}")
+    total = len(CASES) + len(LOAD_CASES)
+    print(f"{total - failures}/{total} diff and load cases passed")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
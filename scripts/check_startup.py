@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# Startup regression check for the CLI.
+#
+#   python scripts/check_startup.py [--budget-ms 50] [--runs 10]
+#
+# Runs `cli.py --include memory` and fails if it imports a heavy optional
+# dependency or another collector, or if it takes more than --budget-ms
+# longer than starting a bare interpreter.
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+CLI = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "syssnap")
+COMMAND = ["cli.py", "--quiet", "--include", "memory", "--out", os.devnull]
+FORBIDDEN = ["yaml", "requests", "urllib3", "cryptography", "zstandard"]
+ALLOWED_COLLECTORS = {"collectors", "collectors.memory"}
+
+
+def imported_modules():
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime"] + COMMAND,
+        cwd=CLI,
+        stderr=subprocess.PIPE,
+        stdout=subprocess.DEVNULL,
+        universal_newlines=True,
+        check=True,
+    )
+    modules = set()
+    for line in result.stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            modules.add(line.rsplit("|", 1)[1].strip())
+    return modules
+
+
+def median_ms(args, runs):
+    times = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.run(args, cwd=CLI, check=True, stdout=subprocess.DEVNULL)
+        times.append(time.perf_counter() - started)
+    return statistics.median(times) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--budget-ms", type=float, default=50.0)
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    failures = []
+    modules = imported_modules()
+    for name in FORBIDDEN:
+        if any(m == name or m.startswith(name + ".") for m in modules):
+            failures.append(f"imports {name}")
+    for name in sorted(modules):
+        if name.startswith("collectors") and name not in ALLOWED_COLLECTORS:
+            failures.append(f"imports {name}")
+
+    baseline = median_ms([sys.executable, "-c", "pass"], args.runs)
+    run = median_ms([sys.executable] + COMMAND, args.runs)
+    print(f"interpreter: {baseline:.1f} ms, --include memory: {run:.1f} ms")
+    if run - baseline > args.budget_ms:
+        failures.append(
+            f"startup overhead {run - baseline:.1f} ms exceeds {args.budget_ms} ms"
+        )
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
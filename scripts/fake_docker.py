@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# Fake Docker Engine API on a unix socket, for exercising the docker
+# collector without a daemon.
+#
+#   python scripts/fake_docker.py /tmp/docker.sock [--containers 2000]
+#   DOCKER_HOST=unix:///tmp/docker.sock python syssnap/cli.py --include docker
+#
+# Serves canned /version, /info, /containers/json, /images/json, /volumes,
+# /networks, /system/df and per-container stats (with --stats-delay to
+# mimic the daemon's sampling), and reports on exit how many connections
+# and requests it saw (stop it with Ctrl-C or SIGTERM).
+
+import argparse
+import json
+import os
+import signal
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import parse_qs, urlparse
+
+
+def make_data(containers, images):
+    image_list = [
+        {
+            "Id": f"sha256:{i:064x}",
+            "RepoTags": [f"app{i}:latest"],
+            "Created": 1700000000 + i,
+            "Size": 100000000 + i,
+        }
+        for i in range(images)
+    ]
+    container_list = [
+        {
+            "Id": f"{i:064x}",
+            "Names": [f"/app{i}"],
+            "Image": f"app{i % max(images, 1)}:latest",
+            "State": "running" if i % 2 == 0 else "exited",
+            "Status": "Up 2 hours" if i % 2 == 0 else "Exited (0) 1 hour ago",
+            "Labels": {"com.example.team": "ci"},
+        }
+        for i in range(containers)
+    ]
+    return {
+        "/version": {"Version": "24.0.7", "ApiVersion": "1.43"},
+        "/info": {
+            "Containers": containers,
+            "Images": images,
+            "Driver": "overlay2",
+            "ServerVersion": "24.0.7",
+        },
+        "/containers/json": container_list,
+        "/images/json": image_list,
+        "/volumes": {"Volumes": [{"Name": "data", "Driver": "local"}]},
+        "/networks": [{"Id": "n1", "Name": "bridge", "Driver": "bridge"}],
+        "/system/df": {"LayersSize": 123456789, "Images": image_list[:1]},
+    }
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_GET(self):
+        with self.server.lock:
+            self.server.requests += 1
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        path = url.path
+        if path.startswith("/containers/") and path.endswith("/stats"):
+            time.sleep(self.server.stats_delay)
+            body = {
+                "id": path.split("/")[2],
+                "read": "2024-01-01T00:00:00Z",
+                "precpu_stats": {},
+                "cpu_stats": {"cpu_usage": {"total_usage": 123456}},
+                "memory_stats": {"usage": 4096, "limit": 1 << 30},
+                "pids_stats": {"current": 3},
+            }
+        elif path in self.server.data:
+            body = self.server.data[path]
+            if path == "/containers/json" and "size" in query:
+                body = [dict(c, SizeRw=1024, SizeRootFs=2048) for c in body]
+        else:
+            self._send(404, {"message": f"page not found: {path}"})
+            return
+        self._send(200, body)
+
+    def _send(self, status, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("socket")
+    parser.add_argument("--containers", type=int, default=20)
+    parser.add_argument("--images", type=int, default=10)
+    parser.add_argument("--stats-delay", type=float, default=0.05)
+    args = parser.parse_args()
+
+    if os.path.exists(args.socket):
+        os.remove(args.socket)
+    server = Server(args.socket, Handler)
+    server.data = make_data(args.containers, args.images)
+    server.stats_delay = args.stats_delay
+    server.lock = threading.Lock()
+    server.connections = 0
+    server.requests = 0
+    # Background jobs ignore SIGINT, so stop cleanly on SIGTERM too
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    print(f"Listening on {args.socket}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(args.socket)
+        print(f"{server.connections} connections, {server.requests} requests")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,13 +2,58 @@
 
 import argparse
 import os
+import sys
 from collectors import ALL_COLLECTORS
-from utils.output import write_output
-from utils.redact import redact_snapshot
-from utils.diff import diff_snapshots
+from utils.output import SnapshotWriter, Tee
+from utils.redact import Redactor
 from utils.plugin import load_plugins
-from utils.upload import upload_snapshot
-from utils.crypto import compress_snapshot, encrypt_snapshot
+from utils.cache import ResultCache, cached, set_cache_mode
+from utils.runner import iter_collect
+from utils.shell import start_probe_cache, stop_probe_cache
+from utils.crypto import (
+    CODECS,
+    DEFAULT_KDF_COST,
+    MAX_KDF_COST,
+    MIN_KDF_COST,
+    CompressedStream,
+    EncryptedStream,
+    check_codec,
+    decrypt_file,
+    read_passphrase,
+)
+
+
+def parse_duration(value):
+    # Accepts "1.5", "1s", "500ms" or "2m"
+    value = value.strip().lower()
+    for suffix, scale in (("ms", 0.001), ("s", 1), ("m", 60)):
+        if value.endswith(suffix):
+            return float(value[: -len(suffix)]) * scale
+    return float(value)
+
+
+def positive_int(value):
+    number = int(value)
+    if number <= 0:
+        raise argparse.ArgumentTypeError(f"must be at least 1: {value}")
+    return number
+
+
+def parse_timeouts(value):
+    # "name=secs[,name=secs...]"; a bare duration sets the default
+    timeouts = []
+    for entry in value.split(","):
+        if not entry.strip():
+            continue
+        name, _, secs = entry.rpartition("=")
+        try:
+            seconds = parse_duration(secs)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"invalid timeout: {entry!r}")
+        if seconds <= 0:
+            raise argparse.ArgumentTypeError(f"timeout must be positive: {entry!r}")
+        timeouts.append((name.strip() or "*", seconds))
+    return timeouts
 
 
 def main():
@@ -17,9 +62,9 @@ def main():
     )
     parser.add_argument(
         "--format",
-        choices=["json", "yaml", "txt"],
+        choices=["json", "ndjson", "yaml", "txt"],
         default="json",
-        help="Output format",
+        help="Output format (ndjson streams one section per line as it completes)",
     )
     parser.add_argument(
         "--include",
@@ -33,37 +78,156 @@ def main():
     parser.add_argument(
         "--out", type=str, help="Write output to file (default: stdout)"
     )
-    parser.add_argument("--redact", action="store_true", help="Redact sensitive fields")
+    parser.add_argument(
+        "--redact",
+        action="store_true",
+        help="Redact sensitive fields and secrets found in text values",
+    )
     parser.add_argument(
         "--anonymize", action="store_true", help="Anonymize host/user/network fields"
     )
     parser.add_argument(
-        "--compress", action="store_true", help="Compress output as ZIP"
+        "--compress",
+        nargs="?",
+        const="zip",
+        choices=sorted(CODECS),
+        help="Compress output (zip, gzip, xz or zstd; default: zip)",
+    )
+    parser.add_argument(
+        "--compress-level", type=int, help="Compression level for --compress"
     )
     parser.add_argument(
         "--encrypt", action="store_true", help="Encrypt output (prompt for passphrase)"
     )
+    parser.add_argument(
+        "--kdf-cost",
+        type=int,
+        default=DEFAULT_KDF_COST,
+        help="scrypt cost for --encrypt as log2(N) (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--decrypt", metavar="FILE", help="Decrypt an encrypted snapshot to --out"
+    )
     parser.add_argument(
         "--plugin-dir", type=str, default="plugins", help="Directory for user plugins"
     )
     parser.add_argument(
         "--upload-url", type=str, help="HTTP(S) endpoint to upload snapshot"
     )
+    parser.add_argument(
+        "--spool-dir",
+        type=str,
+        help="Queue for snapshots that could not be uploaded "
+        "(default: ~/.cache/syssnap/spool)",
+    )
+    parser.add_argument(
+        "--drain-spool",
+        action="store_true",
+        help="Upload queued snapshots and exit",
+    )
     parser.add_argument("--diff", nargs=2, help="Compare two snapshots")
     parser.add_argument("--quiet", action="store_true", help="Suppress progress output")
+    parser.add_argument(
+        "--jobs",
+        type=positive_int,
+        default=None,
+        help="Number of collectors to run concurrently (default: all at once)",
+    )
+    parser.add_argument(
+        "--timeout", type=float, help="Deadline in seconds for the whole snapshot"
+    )
+    parser.add_argument(
+        "--collector-timeout",
+        type=parse_timeouts,
+        nargs="*",
+        help="Per-collector deadlines as name=secs, or secs to set the default",
+    )
+    parser.add_argument(
+        "--sample-interval",
+        type=parse_duration,
+        help="Sample activity over this interval (e.g. 1s) for top CPU/IO consumers",
+    )
+    parser.add_argument(
+        "--python-env",
+        type=str,
+        nargs="*",
+        help="Also inventory these venvs, interpreter prefixes or site-packages",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Neither read nor write cached results of slow-changing collectors",
+    )
+    parser.add_argument(
+        "--refresh-cache",
+        action="store_true",
+        help="Recompute cached collectors and update the cache",
+    )
+    parser.add_argument(
+        "--netconns-detail",
+        action="store_true",
+        help="Include every connection in netconns instead of aggregates only",
+    )
+    parser.add_argument(
+        "--docker-stats",
+        action="store_true",
+        help="Include per-container resource stats and disk usage in docker",
+    )
+    parser.add_argument(
+        "--service-properties",
+        type=str,
+        help="Comma-separated systemd unit properties to collect, or 'all'",
+    )
 
     args = parser.parse_args()
 
-    # Load plugins
-    user_plugins = load_plugins(args.plugin_dir)
-    modules = set(ALL_COLLECTORS.keys()).union(user_plugins.keys())
-
-    # Diff mode
+    # Diff mode. The diff, upload and encryption support, and their
+    # dependencies, are only imported when the feature is used.
     if args.diff:
-        diff_result = diff_snapshots(args.diff[0], args.diff[1], fmt=args.format)
+        from utils.diff import diff_snapshots
+
+        try:
+            diff_result = diff_snapshots(args.diff[0], args.diff[1], fmt=args.format)
+        except ValueError as e:
+            parser.exit(1, f"{parser.prog}: {e}\n")
         print(diff_result)
         return
 
+    if args.drain_spool:
+        from utils.upload import Spool, Uploader, drain
+
+        spool = Spool(args.spool_dir)
+        uploader = Uploader()
+        try:
+            sent, left = drain(spool, uploader)
+        finally:
+            uploader.close()
+        print(f"Sent {sent} spooled snapshot(s), {left} still queued.", file=sys.stderr)
+        sys.exit(1 if left else 0)
+
+    if args.decrypt:
+        out = open(args.out, "wb") if args.out else sys.stdout.buffer
+        try:
+            decrypt_file(args.decrypt, out, read_passphrase())
+        except ValueError as e:
+            parser.exit(1, f"{parser.prog}: {e}\n")
+        finally:
+            if args.out:
+                out.close()
+        return
+
+    # --no-cache and --refresh-cache apply to every on-disk cache, including
+    # the plugin manifests and the collectors' own lookup caches
+    if args.no_cache:
+        set_cache_mode("off")
+    elif args.refresh_cache:
+        set_cache_mode("refresh")
+
+    # Plugins are discovered from their manifests; a plugin module is only
+    # imported if it is selected
+    user_plugins = load_plugins(args.plugin_dir)
+    modules = set(ALL_COLLECTORS.keys()).union(user_plugins.keys())
+
     # Filter modules
     if args.include:
         # Handle both "module1,module2" and "module1 module2" formats
@@ -91,41 +255,177 @@ def main():
 
     final_modules = include - exclude
 
-    # Collect system data
-    snapshot = {}
-    for module in final_modules:
-        if module in ALL_COLLECTORS:
+    # Collect system data, keeping the output order stable: built-in
+    # collectors in registry order, then plugins by name
+    result_cache = None if args.no_cache else ResultCache(read=not args.refresh_cache)
+    tasks = []
+    for module in ALL_COLLECTORS:
+        if module in final_modules:
             if not args.quiet:
-                print(f"Collecting: {module}...")
-            snapshot[module] = ALL_COLLECTORS[module].collect()
-        elif module in user_plugins:
+                print(f"Collecting: {module}...", file=sys.stderr)
+            tasks.append((module, cached(module, ALL_COLLECTORS[module], result_cache)))
+    for module in sorted(final_modules - set(ALL_COLLECTORS)):
+        if module in user_plugins:
             if not args.quiet:
-                print(f"Collecting (plugin): {module}...")
-            snapshot[module] = user_plugins[module].collect()
+                print(f"Collecting (plugin): {module}...", file=sys.stderr)
+            tasks.append((module, user_plugins[module]))
         else:
-            print(f"Unknown module: {module}")
+            print(f"Unknown module: {module}", file=sys.stderr)
+    collector_timeouts = {}
+    for timeouts in args.collector_timeout or []:
+        collector_timeouts.update(timeouts)
+    options = {
+        "processes": {},
+        "netconns": {},
+        "python": {},
+        "docker": {},
+        "services": {},
+    }
+    if args.sample_interval:
+        options["processes"]["sample_interval"] = args.sample_interval
+        options["netconns"]["sample_interval"] = args.sample_interval
+    if args.netconns_detail:
+        options["netconns"]["detail"] = True
+    if args.python_env:
+        options["python"]["envs"] = args.python_env
+    if args.docker_stats:
+        options["docker"]["stats"] = True
+    if args.service_properties:
+        properties = [p.strip() for p in args.service_properties.split(",")]
+        options["services"]["properties"] = [p for p in properties if p]
 
-    # Redact/anonymize if requested
-    if args.redact or args.anonymize:
-        snapshot = redact_snapshot(
-            snapshot, redact=args.redact, anonymize=args.anonymize
-        )
-
-    # Output formatting/writing
+    # Stream each section to the output, and through the compressor and
+    # encryptor, as soon as it is collected. The upload body is written to
+    # the spool as it is produced and sent from there once complete.
+    if args.compress:
+        try:
+            check_codec(args.compress, args.compress_level)
+        except (RuntimeError, ValueError) as e:
+            parser.error(str(e))
+    passphrase = None
+    if args.encrypt:
+        if not MIN_KDF_COST <= args.kdf_cost <= MAX_KDF_COST:
+            parser.error(
+                f"--kdf-cost must be between {MIN_KDF_COST} and {MAX_KDF_COST}"
+            )
+        try:
+            passphrase = read_passphrase(confirm=True)
+        except ValueError as e:
+            parser.error(str(e))
     output_path = args.out
-    result_bytes = write_output(
-        snapshot, fmt=args.format, out=output_path, as_bytes=True
-    )
+    files = []
 
-    # Compress/encrypt
-    if args.compress:
-        result_bytes = compress_snapshot(result_bytes, output_path)
+    def open_output(path):
+        f = open(path, "wb")
+        files.append(f)
+        return f
+
+    # Without --out, stdout gets the encrypted stream instead of plain text
+    sinks = []
+    if output_path:
+        sinks.append(open_output(output_path))
+    elif not args.encrypt:
+        sinks.append(sys.stdout.buffer)
+    # The last stage (encryption, else compression, else the document) is
+    # what gets uploaded; only the plain document is gzipped for the wire
+    spool = None
+    upload_entry = None
+    if args.upload_url:
+        from utils.upload import Spool, Uploader, content_type, deliver
+
+        spool = Spool(args.spool_dir)
+        encode = not (args.compress or args.encrypt)
+        upload_entry = spool.create(
+            args.upload_url,
+            content_type(args.format) if encode else "application/octet-stream",
+            encode=encode,
+        )
+    last_stage = upload_entry
+    encryptor = None
     if args.encrypt:
-        result_bytes = encrypt_snapshot(result_bytes, output_path)
+        if output_path:
+            dests = [open_output(output_path + ".enc")]
+        else:
+            dests = [sys.stdout.buffer]
+        if upload_entry is not None:
+            dests.append(upload_entry)
+        encryptor = EncryptedStream(Tee(*dests), passphrase, cost=args.kdf_cost)
+        last_stage = encryptor
+    compressor = None
+    if args.compress:
+        dests = []
+        if output_path:
+            dests.append(open_output(output_path + CODECS[args.compress]))
+        if last_stage is not None:
+            dests.append(last_stage)
+        compressor = CompressedStream(
+            Tee(*dests), codec=args.compress, level=args.compress_level
+        )
+        last_stage = compressor
+    if last_stage is not None:
+        sinks.append(last_stage)
+    writer = SnapshotWriter(Tee(*sinks), fmt=args.format)
+
+    redactor = None
+    if args.redact or args.anonymize:
+        redactor = Redactor(redact=args.redact, anonymize=args.anonymize)
+
+    start_probe_cache()
+    try:
+        for name, data in iter_collect(
+            tasks,
+            jobs=args.jobs,
+            timeout=args.timeout,
+            collector_timeouts=collector_timeouts,
+            options=options,
+            ordered=args.format != "ndjson",
+        ):
+            # A plugin candidate that defines no collect() after all
+            if data is None:
+                continue
+            # Redact/anonymize if requested
+            if redactor:
+                data = redactor.section(name, data)
+            writer.write_section(name, data)
+        writer.close()
+        if compressor:
+            compressor.close()
+        if encryptor:
+            encryptor.close()
+        if upload_entry:
+            upload_entry.close()
+            upload_name, upload_entry = upload_entry.name, None
+    finally:
+        if upload_entry:
+            upload_entry.discard()
+        for f in files:
+            f.close()
+    probe_stats = stop_probe_cache().stats()
+    if not args.quiet:
+        print(
+            f"Probe cache: {probe_stats['hits']} hits, {probe_stats['misses']} misses",
+            file=sys.stderr,
+        )
+    if redactor and redactor.scanner and not args.quiet:
+        hits = redactor.scanner.hits
+        found = ", ".join(f"{name}={count}" for name, count in hits.items() if count)
+        print(f"Secrets redacted: {found or 'none'}", file=sys.stderr)
+    if compressor and not args.quiet:
+        stats = compressor.stats()
+        print(
+            f"Compressed ({stats['codec']}): {stats['bytes_in']} -> "
+            f"{stats['bytes_out']} bytes, ratio {stats['ratio']}, "
+            f"{stats['mb_per_sec']} MB/s",
+            file=sys.stderr,
+        )
 
     # Upload if needed
-    if args.upload_url:
-        upload_snapshot(result_bytes, args.upload_url, args.format)
+    if spool:
+        uploader = Uploader()
+        try:
+            deliver(spool, upload_name, uploader)
+        finally:
+            uploader.close()
 
 
 if __name__ == "__main__":
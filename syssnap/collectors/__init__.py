@@ -1,45 +1,56 @@
-from . import (
-    cpu,
-    memory,
-    disk,
-    network,
-    osinfo,
-    packages,
-    processes,
-    logs,
-    env,
-    docker,
-    python,
-    services,
-    crontab,
-    users,
-    hardware,
-    kernelmods,
-    limits,
-    firewall,
-    mounts,
-    netconns,
-)
-
-ALL_COLLECTORS = {
-    "cpu": cpu,
-    "memory": memory,
-    "disk": disk,
-    "network": network,
-    "osinfo": osinfo,
-    "packages": packages,
-    "processes": processes,
-    "logs": logs,
-    "env": env,
-    "docker": docker,
-    "python": python,
-    "services": services,
-    "crontab": crontab,
-    "users": users,
-    "hardware": hardware,
-    "kernelmods": kernelmods,
-    "limits": limits,
-    "firewall": firewall,
-    "mounts": mounts,
-    "netconns": netconns,
-}
+import importlib
+from collections.abc import Mapping
+
+# Collectors in output order. Each module is imported the first time it is
+# looked up, so a run that selects a few sections only loads those.
+COLLECTOR_NAMES = [
+    "cpu",
+    "memory",
+    "disk",
+    "network",
+    "osinfo",
+    "packages",
+    "processes",
+    "logs",
+    "env",
+    "docker",
+    "python",
+    "services",
+    "crontab",
+    "users",
+    "hardware",
+    "kernelmods",
+    "limits",
+    "firewall",
+    "mounts",
+    "netconns",
+]
+
+
+class CollectorRegistry(Mapping):
+    def __init__(self, names, package):
+        self._names = list(names)
+        self._known = set(names)
+        self._package = package
+        self._modules = {}
+
+    def __getitem__(self, name):
+        module = self._modules.get(name)
+        if module is None:
+            if name not in self._known:
+                raise KeyError(name)
+            module = importlib.import_module(f"{self._package}.{name}")
+            self._modules[name] = module
+        return module
+
+    def __contains__(self, name):
+        return name in self._known
+
+    def __iter__(self):
+        return iter(self._names)
+
+    def __len__(self):
+        return len(self._names)
+
+
+ALL_COLLECTORS = CollectorRegistry(COLLECTOR_NAMES, __name__)
@@ -1,10 +1,10 @@
-import subprocess
+from utils.shell import run
 
 
 def collect():
     cpu_info = {}
     try:
-        lscpu = subprocess.run(["lscpu"], capture_output=True, text=True)
+        lscpu = run(["lscpu"])
         for line in lscpu.stdout.splitlines():
             if ":" in line:
                 key, val = [s.strip() for s in line.split(":", 1)]
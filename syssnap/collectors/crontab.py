@@ -1,16 +1,15 @@
-import subprocess
+from utils.shell import run, read_file
 
 
 def collect():
     cron = {}
     try:
         # Per-user crontab
-        user_cron = subprocess.run(["crontab", "-l"], capture_output=True, text=True)
+        user_cron = run(["crontab", "-l"])
         cron["user_crontab"] = user_cron.stdout
         # System crontab
         try:
-            with open("/etc/crontab") as f:
-                cron["etc_crontab"] = f.read()
+            cron["etc_crontab"] = read_file("/etc/crontab")
         except Exception:
             cron["etc_crontab"] = "N/A"
     except Exception as e:
@@ -1,22 +1,20 @@
-import subprocess
+from utils.shell import run
 
 
 def collect():
     disk_info = {"partitions": [], "usage": []}
     try:
         # List block devices
-        lsblk = subprocess.run(
-            ["lsblk", "-o", "NAME,SIZE,TYPE,MOUNTPOINT"], capture_output=True, text=True
-        )
+        lsblk = run(["lsblk", "-o", "NAME,SIZE,TYPE,MOUNTPOINT"])
         disk_info["lsblk"] = lsblk.stdout
 
         # Partition usage
-        df = subprocess.run(["df", "-h"], capture_output=True, text=True)
+        df = run(["df", "-h"])
         disk_info["df"] = df.stdout
 
         # IO statistics
         try:
-            iostat = subprocess.run(["iostat"], capture_output=True, text=True)
+            iostat = run(["iostat"])
             disk_info["iostat"] = iostat.stdout
         except Exception:
             disk_info["iostat"] = "iostat not available"
@@ -1,28 +1,160 @@
-import subprocess
-import shutil
+import http.client
+import json
+import os
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
 
+from utils.shell import current_deadline
+
+# Talks to the Docker Engine API directly instead of forking the docker CLI
+# (a Go binary startup and a daemon round-trip per command, with truncated
+# table output). Each worker thread keeps one keep-alive connection, so the
+# API calls run concurrently without reconnecting for every request.
+DEFAULT_HOST = "unix:///var/run/docker.sock"
+TIMEOUT = 30.0
+WORKERS = 8
+# Stats fields that are per-read bookkeeping rather than state
+STATS_SKIP = {"id", "name", "read", "preread", "precpu_stats", "num_procs"}
+
+
+class DockerError(Exception):
+    pass
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path, timeout=TIMEOUT):
+        super().__init__("localhost", timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.path)
+        except OSError:
+            sock.close()
+            raise
+        self.sock = sock
 
-def collect():
-    docker = {}
-    try:
-        if not shutil.which("docker"):
-            docker["error"] = "docker CLI not installed"
-            return docker
 
-        docker_info = subprocess.run(["docker", "info"], capture_output=True, text=True)
-        docker["info"] = docker_info.stdout
+class DockerClient:
+    def __init__(self, host=None, timeout=TIMEOUT):
+        self.host = host or os.environ.get("DOCKER_HOST") or DEFAULT_HOST
+        self.timeout = timeout
+        # Worker threads do not inherit the collector's deadline
+        self.deadline = current_deadline()
+        url = urlparse(self.host)
+        if url.scheme == "unix":
+            self._connect = lambda: UnixHTTPConnection(url.path, timeout)
+        elif url.scheme == "tcp":
+            self._connect = lambda: http.client.HTTPConnection(
+                url.hostname, url.port or 2375, timeout=timeout
+            )
+        else:
+            raise DockerError(f"Unsupported DOCKER_HOST: {self.host}")
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
 
-        ps = subprocess.run(["docker", "ps", "-a"], capture_output=True, text=True)
-        docker["containers"] = ps.stdout
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+            with self._lock:
+                self._connections.append(conn)
+        return conn
 
-        images = subprocess.run(["docker", "images"], capture_output=True, text=True)
-        docker["images"] = images.stdout
+    def _timeout(self):
+        remaining = self.deadline.remaining() if self.deadline else None
+        if remaining is None:
+            return self.timeout
+        if remaining <= 0:
+            raise DockerError("Deadline exceeded")
+        return min(self.timeout, remaining)
 
-        volumes = subprocess.run(
-            ["docker", "volume", "ls"], capture_output=True, text=True
-        )
-        docker["volumes"] = volumes.stdout
+    def get(self, path):
+        conn = self._connection()
+        conn.timeout = self._timeout()
+        if conn.sock is not None:
+            conn.sock.settimeout(conn.timeout)
+        # The daemon may have closed an idle keep-alive connection; retry
+        # once on a fresh one
+        for attempt in range(2):
+            try:
+                conn.request("GET", path)
+                response = conn.getresponse()
+                body = response.read()
+                break
+            except (http.client.RemoteDisconnected, BrokenPipeError):
+                conn.close()
+                if attempt:
+                    raise
+        if response.status >= 400:
+            try:
+                message = json.loads(body)["message"]
+            except (ValueError, KeyError, TypeError):
+                message = body.decode("utf-8", "replace").strip()
+            raise DockerError(f"{path}: {response.status} {message}")
+        return json.loads(body) if body else None
 
+    def close(self):
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections = []
+
+
+def _stats(client, container_id):
+    # one-shot skips the daemon's second sample (about a second per
+    # container); older daemons ignore it
+    stats = client.get(f"/containers/{container_id}/stats?stream=false&one-shot=true")
+    return {k: v for k, v in (stats or {}).items() if k not in STATS_SKIP}
+
+
+def collect(stats=False):
+    docker = {}
+    try:
+        client = DockerClient()
+    except DockerError as e:
+        return {"error": str(e)}
+    paths = {
+        "version": "/version",
+        "info": "/info",
+        "containers": "/containers/json?all=1" + ("&size=1" if stats else ""),
+        "images": "/images/json",
+        "volumes": "/volumes",
+        "networks": "/networks",
+    }
+    if stats:
+        paths["disk_usage"] = "/system/df"
+    try:
+        with ThreadPoolExecutor(max_workers=WORKERS) as pool:
+            # Fail fast with one clear error when the daemon is unreachable
+            try:
+                docker["version"] = client.get(paths.pop("version"))
+            except (FileNotFoundError, ConnectionRefusedError, PermissionError) as e:
+                return {"error": f"Cannot connect to {client.host}: {e}"}
+            futures = {key: pool.submit(client.get, p) for key, p in paths.items()}
+            for key, future in futures.items():
+                try:
+                    docker[key] = future.result()
+                except (DockerError, OSError, http.client.HTTPException) as e:
+                    docker[key] = {"error": str(e)}
+            if isinstance(docker.get("volumes"), dict):
+                docker["volumes"] = docker["volumes"].get("Volumes") or []
+            containers = docker["containers"]
+            if stats and isinstance(containers, list):
+                running = [c for c in containers if c.get("State") == "running"]
+                futures = [(c, pool.submit(_stats, client, c["Id"])) for c in running]
+                for container, future in futures:
+                    try:
+                        container["stats"] = future.result()
+                    except (DockerError, OSError, http.client.HTTPException) as e:
+                        container["stats"] = {"error": str(e)}
     except Exception as e:
         docker["error"] = str(e)
+    finally:
+        client.close()
     return docker
@@ -1,4 +1,4 @@
-import subprocess
+from utils.shell import run
 import shutil
 
 
@@ -9,34 +9,22 @@ def collect():
         if shutil.which("iptables"):
             try:
                 # Get iptables rules with verbose output
-                iptables_list = subprocess.run(
-                    ["iptables", "-L", "-n", "-v"], 
-                    capture_output=True, text=True
-                )
+                iptables_list = run(["iptables", "-L", "-n", "-v"])
                 if iptables_list.returncode == 0:
                     firewall["iptables_list"] = iptables_list.stdout
                 
                 # Get NAT table rules
-                iptables_nat = subprocess.run(
-                    ["iptables", "-t", "nat", "-L", "-n", "-v"],
-                    capture_output=True, text=True
-                )
+                iptables_nat = run(["iptables", "-t", "nat", "-L", "-n", "-v"])
                 if iptables_nat.returncode == 0:
                     firewall["iptables_nat"] = iptables_nat.stdout
                 
                 # Get mangle table rules
-                iptables_mangle = subprocess.run(
-                    ["iptables", "-t", "mangle", "-L", "-n", "-v"],
-                    capture_output=True, text=True
-                )
+                iptables_mangle = run(["iptables", "-t", "mangle", "-L", "-n", "-v"])
                 if iptables_mangle.returncode == 0:
                     firewall["iptables_mangle"] = iptables_mangle.stdout
                     
                 # Get raw table rules  
-                iptables_raw = subprocess.run(
-                    ["iptables", "-t", "raw", "-L", "-n", "-v"],
-                    capture_output=True, text=True
-                )
+                iptables_raw = run(["iptables", "-t", "raw", "-L", "-n", "-v"])
                 if iptables_raw.returncode == 0:
                     firewall["iptables_raw"] = iptables_raw.stdout
                     
@@ -46,10 +34,7 @@ def collect():
         # Check for ip6tables (IPv6)
         if shutil.which("ip6tables"):
             try:
-                ip6tables_list = subprocess.run(
-                    ["ip6tables", "-L", "-n", "-v"],
-                    capture_output=True, text=True
-                )
+                ip6tables_list = run(["ip6tables", "-L", "-n", "-v"])
                 if ip6tables_list.returncode == 0:
                     firewall["ip6tables_list"] = ip6tables_list.stdout
             except Exception as e:
@@ -58,18 +43,12 @@ def collect():
         # Check for UFW (Uncomplicated Firewall)
         if shutil.which("ufw"):
             try:
-                ufw_status = subprocess.run(
-                    ["ufw", "status", "verbose"],
-                    capture_output=True, text=True
-                )
+                ufw_status = run(["ufw", "status", "verbose"])
                 if ufw_status.returncode == 0:
                     firewall["ufw_status"] = ufw_status.stdout
                 
                 # Get numbered rules for easier troubleshooting
-                ufw_numbered = subprocess.run(
-                    ["ufw", "status", "numbered"],
-                    capture_output=True, text=True
-                )
+                ufw_numbered = run(["ufw", "status", "numbered"])
                 if ufw_numbered.returncode == 0:
                     firewall["ufw_numbered"] = ufw_numbered.stdout
                     
@@ -80,46 +59,28 @@ def collect():
         if shutil.which("firewall-cmd"):
             try:
                 # Check if firewalld is running
-                firewalld_state = subprocess.run(
-                    ["firewall-cmd", "--state"],
-                    capture_output=True, text=True
-                )
+                firewalld_state = run(["firewall-cmd", "--state"])
                 firewall["firewalld_state"] = firewalld_state.stdout.strip()
                 
                 if firewalld_state.returncode == 0:
                     # Get default zone
-                    default_zone = subprocess.run(
-                        ["firewall-cmd", "--get-default-zone"],
-                        capture_output=True, text=True
-                    )
+                    default_zone = run(["firewall-cmd", "--get-default-zone"])
                     firewall["firewalld_default_zone"] = default_zone.stdout.strip()
                     
                     # Get active zones
-                    active_zones = subprocess.run(
-                        ["firewall-cmd", "--get-active-zones"],
-                        capture_output=True, text=True
-                    )
+                    active_zones = run(["firewall-cmd", "--get-active-zones"])
                     firewall["firewalld_active_zones"] = active_zones.stdout
                     
                     # List all zones and their rules
-                    zones_list = subprocess.run(
-                        ["firewall-cmd", "--list-all-zones"],
-                        capture_output=True, text=True
-                    )
+                    zones_list = run(["firewall-cmd", "--list-all-zones"])
                     firewall["firewalld_all_zones"] = zones_list.stdout
                     
                     # Get services
-                    services = subprocess.run(
-                        ["firewall-cmd", "--list-services"],
-                        capture_output=True, text=True
-                    )
+                    services = run(["firewall-cmd", "--list-services"])
                     firewall["firewalld_services"] = services.stdout.strip()
                     
                     # Get ports
-                    ports = subprocess.run(
-                        ["firewall-cmd", "--list-ports"],
-                        capture_output=True, text=True
-                    )
+                    ports = run(["firewall-cmd", "--list-ports"])
                     firewall["firewalld_ports"] = ports.stdout.strip()
                     
             except Exception as e:
@@ -128,10 +89,7 @@ def collect():
         # Check for nftables (newer netfilter framework)
         if shutil.which("nft"):
             try:
-                nft_list = subprocess.run(
-                    ["nft", "list", "ruleset"],
-                    capture_output=True, text=True
-                )
+                nft_list = run(["nft", "list", "ruleset"])
                 if nft_list.returncode == 0:
                     firewall["nftables_rules"] = nft_list.stdout
             except Exception as e:
@@ -140,20 +98,14 @@ def collect():
         # Check for common ports listening (for context)
         if shutil.which("ss"):
             try:
-                listening_ports = subprocess.run(
-                    ["ss", "-tuln"],
-                    capture_output=True, text=True
-                )
+                listening_ports = run(["ss", "-tulpn"])
                 if listening_ports.returncode == 0:
                     firewall["listening_ports"] = listening_ports.stdout
             except Exception:
                 # Fallback to netstat if available
                 if shutil.which("netstat"):
                     try:
-                        netstat_ports = subprocess.run(
-                            ["netstat", "-tuln"],
-                            capture_output=True, text=True
-                        )
+                        netstat_ports = run(["netstat", "-tuln"])
                         if netstat_ports.returncode == 0:
                             firewall["listening_ports"] = netstat_ports.stdout
                     except Exception:
@@ -162,10 +114,7 @@ def collect():
         # Check for fail2ban status (common security tool)
         if shutil.which("fail2ban-client"):
             try:
-                fail2ban_status = subprocess.run(
-                    ["fail2ban-client", "status"],
-                    capture_output=True, text=True
-                )
+                fail2ban_status = run(["fail2ban-client", "status"])
                 if fail2ban_status.returncode == 0:
                     firewall["fail2ban_status"] = fail2ban_status.stdout
             except Exception as e:
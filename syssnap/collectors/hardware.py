@@ -1,24 +1,276 @@
-import subprocess
-import shutil
+import os
+from utils.cache import read_json, write_json
+
+# Read from sysfs: no root, and none of lshw (which probes buses and can
+# take seconds), lspci, lsusb or dmidecode. Vendor and device names come
+# from the local pci.ids/usb.ids databases when they are installed.
+SYS = "/sys"
+PCI_IDS = [
+    "/usr/share/hwdata/pci.ids",
+    "/usr/share/misc/pci.ids",
+    "/usr/share/pci.ids",
+]
+USB_IDS = [
+    "/usr/share/hwdata/usb.ids",
+    "/usr/share/misc/usb.ids",
+    "/var/lib/usbutils/usb.ids",
+    "/usr/share/usb.ids",
+]
+# Bumped when the cached names change meaning; version 1 caches mistook
+# vendors such as c0a9 for device classes
+CACHE_VERSION = 2
+DMI_FIELDS = [
+    "sys_vendor",
+    "product_name",
+    "product_version",
+    "product_family",
+    "board_vendor",
+    "board_name",
+    "board_version",
+    "bios_vendor",
+    "bios_version",
+    "bios_date",
+    "chassis_vendor",
+    "chassis_type",
+    # Only readable by root; left out otherwise
+    "product_serial",
+    "product_uuid",
+    "board_serial",
+    "chassis_serial",
+]
+
+
+def _read(path):
+    try:
+        with open(path, errors="replace") as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def _link(path):
+    try:
+        return os.path.basename(os.readlink(path))
+    except OSError:
+        return None
+
+
+def _hex(value):
+    return value[2:] if value and value.startswith("0x") else value
+
+
+def _entries(base):
+    try:
+        with os.scandir(base) as it:
+            return sorted(it, key=lambda e: e.name)
+    except OSError:
+        return []
+
+
+class IdsDatabase:
+    # Names from a pci.ids/usb.ids file, which is over a megabyte. Resolved
+    # names (and misses) are cached per file and mtime, so the file is only
+    # read, in a single pass, when a device not seen before shows up.
+    def __init__(self, kind, candidates):
+        self.source = next((p for p in candidates if os.path.isfile(p)), None)
+        self.names = {}
+        if self.source is None:
+            return
+        self.mtime = os.stat(self.source).st_mtime_ns
+        self.cache_name = kind + ".json"
+        cached = read_json("hardware", self.cache_name) or {}
+        signature = (cached.get("version"), cached.get("source"), cached.get("mtime"))
+        if signature == (CACHE_VERSION, self.source, self.mtime):
+            self.names = cached["names"]
+
+    def resolve(self, keys):
+        # Keys are lowercase hex: "vendor", "vendor:device", and for PCI
+        # classes "C class" and "C class:subclass". Unknown keys map to None.
+        if self.source is None:
+            return {}
+        missing = set(keys) - set(self.names)
+        if missing:
+            self._scan(missing)
+            for key in missing:
+                self.names.setdefault(key, None)
+            self._save()
+        return {key: self.names[key] for key in keys}
+
+    def _scan(self, missing):
+        parents = {key.split(":")[0] for key in missing}
+        parent = None
+        with open(self.source, encoding="utf-8", errors="replace") as f:
+            for line in f:
+                if line.startswith("#") or not line.strip():
+                    continue
+                if line[0] != "\t":
+                    # "8086  Intel Corporation" or "C 06  Bridge"; vendor
+                    # ids such as c0a9 start with a "c" too
+                    key, _, name = line.rstrip("\n").partition("  ")
+                    if key.startswith("C "):
+                        key = "C" + key[2:].strip().lower()
+                    else:
+                        key = key.strip().lower()
+                    parent = key if key in parents else None
+                    if parent in missing:
+                        self.names[parent] = name.strip()
+                elif parent and line[1] != "\t":
+                    # Devices or subclasses; subsystems are nested deeper
+                    key, _, name = line.strip().partition("  ")
+                    key = f"{parent}:{key.lower()}"
+                    if key in missing:
+                        self.names[key] = name.strip()
+
+    def _save(self):
+        cached = {
+            "version": CACHE_VERSION,
+            "source": self.source,
+            "mtime": self.mtime,
+            "names": self.names,
+        }
+        write_json("hardware", self.cache_name, cached)
+
+
+def read_dmi(base=SYS + "/class/dmi/id"):
+    dmi = {}
+    for field in DMI_FIELDS:
+        value = _read(os.path.join(base, field))
+        if value:
+            dmi[field] = value
+    return dmi
+
+
+def read_pci(base=SYS + "/bus/pci/devices"):
+    devices = []
+    for entry in _entries(base):
+        path = entry.path
+        devices.append(
+            {
+                "slot": entry.name,
+                "class_id": (_hex(_read(path + "/class")) or "")[:4],
+                "vendor_id": _hex(_read(path + "/vendor")),
+                "device_id": _hex(_read(path + "/device")),
+                "subsystem_vendor_id": _hex(_read(path + "/subsystem_vendor")),
+                "subsystem_device_id": _hex(_read(path + "/subsystem_device")),
+                "revision": _hex(_read(path + "/revision")),
+                "driver": _link(path + "/driver"),
+            }
+        )
+    return devices
+
+
+def read_usb(base=SYS + "/bus/usb/devices"):
+    devices = []
+    for entry in _entries(base):
+        path = entry.path
+        vendor_id = _read(path + "/idVendor")
+        # Interfaces ("1-1:1.0") are listed alongside the devices
+        if vendor_id is None:
+            continue
+        devices.append(
+            {
+                "path": entry.name,
+                "bus": _read(path + "/busnum"),
+                "device": _read(path + "/devnum"),
+                "vendor_id": vendor_id,
+                "product_id": _read(path + "/idProduct"),
+                "manufacturer": _read(path + "/manufacturer"),
+                "product": _read(path + "/product"),
+                "speed_mbps": _read(path + "/speed"),
+            }
+        )
+    return devices
+
+
+def read_block(base=SYS + "/block"):
+    devices = []
+    for entry in _entries(base):
+        path = entry.path
+        sectors = _read(path + "/size")
+        size = int(sectors) * 512 if sectors and sectors.isdigit() else None
+        # Unused loop and ram disks
+        if not size and entry.name.startswith(("loop", "ram")):
+            continue
+        devices.append(
+            {
+                "name": entry.name,
+                "size_bytes": size,
+                "rotational": _read(path + "/queue/rotational") == "1",
+                "removable": _read(path + "/removable") == "1",
+                "vendor": _read(path + "/device/vendor"),
+                "model": _read(path + "/device/model"),
+            }
+        )
+    return devices
+
+
+def read_net(base=SYS + "/class/net"):
+    interfaces = []
+    for entry in _entries(base):
+        path = entry.path
+        mtu = _read(path + "/mtu")
+        # Reading speed fails (EINVAL) while the link is down
+        speed = _read(path + "/speed")
+        interfaces.append(
+            {
+                "name": entry.name,
+                "mac": _read(path + "/address"),
+                "mtu": int(mtu) if mtu and mtu.isdigit() else None,
+                "operstate": _read(path + "/operstate"),
+                "speed_mbps": int(speed) if speed and speed.isdigit() else None,
+                "driver": _link(path + "/device/driver"),
+                "virtual": not os.path.exists(path + "/device"),
+            }
+        )
+    return interfaces
+
+
+def name_pci(devices):
+    keys = {}
+    for device in devices:
+        vendor, cls = device["vendor_id"], device["class_id"]
+        keys[id(device)] = (
+            vendor,
+            f"{vendor}:{device['device_id']}",
+            "C" + cls[:2],
+            f"C{cls[:2]}:{cls[2:]}",
+        )
+    names = IdsDatabase("pci", PCI_IDS).resolve({k for ks in keys.values() for k in ks})
+    for device in devices:
+        vendor, product, cls, subclass = keys[id(device)]
+        device["vendor"] = names.get(vendor)
+        device["device"] = names.get(product)
+        device["class"] = names.get(subclass) or names.get(cls)
+
+
+def name_usb(devices):
+    keys = set()
+    for device in devices:
+        keys.add(device["vendor_id"])
+        keys.add(f"{device['vendor_id']}:{device['product_id']}")
+    names = IdsDatabase("usb", USB_IDS).resolve(keys)
+    for device in devices:
+        # Strings reported by the device itself take precedence
+        product = f"{device['vendor_id']}:{device['product_id']}"
+        device["manufacturer"] = device["manufacturer"] or names.get(
+            device["vendor_id"]
+        )
+        device["product"] = device["product"] or names.get(product)
 
 
 def collect():
     hw = {}
     try:
-        if shutil.which("lshw"):
-            lshw = subprocess.run(["lshw", "-short"], capture_output=True, text=True)
-            hw["lshw"] = lshw.stdout
-        if shutil.which("lsusb"):
-            lsusb = subprocess.run(["lsusb"], capture_output=True, text=True)
-            hw["lsusb"] = lsusb.stdout
-        if shutil.which("lspci"):
-            lspci = subprocess.run(["lspci"], capture_output=True, text=True)
-            hw["lspci"] = lspci.stdout
-        if shutil.which("dmidecode"):
-            dmi = subprocess.run(
-                ["dmidecode", "-t", "system"], capture_output=True, text=True
-            )
-            hw["dmidecode_system"] = dmi.stdout
+        hw["dmi"] = read_dmi()
+        hw["pci"] = read_pci()
+        hw["usb"] = read_usb()
+        hw["block"] = read_block()
+        hw["net"] = read_net()
+        # The ids databases are only opened when there is something to name
+        if hw["pci"]:
+            name_pci(hw["pci"])
+        if hw["usb"]:
+            name_usb(hw["usb"])
     except Exception as e:
         hw["error"] = str(e)
     return hw
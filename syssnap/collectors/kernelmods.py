@@ -1,66 +1,197 @@
-import subprocess
-import shutil
+import os
+from utils.cache import read_json, write_json
 
+# Read from /proc/modules and /sys/module, without forking lsmod, modinfo,
+# uname or find. Module parameters can be changed at runtime, so the result
+# is not cached; the modules.dep/modules.alias lookups are, per release.
+PROC_MODULES = "/proc/modules"
+SYS_MODULE = "/sys/module"
+MODULES_DIR = "/lib/modules"
+MODPROBE_DIR = "/etc/modprobe.d"
+CRITICAL_MODULES = [
+    "nvidia",
+    "amdgpu",
+    "i915",
+    "nouveau",
+    "radeon",
+    "iwlwifi",
+    "ath9k",
+    "rtw88",
+    "r8169",
+    "e1000e",
+]
 
-def collect():
-    kernelmods = {}
+
+def _read(path):
     try:
-        # Get loaded kernel modules with lsmod
-        lsmod = subprocess.run(["lsmod"], capture_output=True, text=True)
-        kernelmods["lsmod"] = lsmod.stdout
-        
-        # Parse lsmod output for structured data
-        modules = []
-        lines = lsmod.stdout.strip().split('\n')[1:]  # Skip header
-        for line in lines:
-            parts = line.split()
-            if len(parts) >= 3:
-                module_data = {
+        with open(path, errors="replace") as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def _listdir(path):
+    try:
+        return sorted(os.listdir(path))
+    except OSError:
+        return []
+
+
+def _module_name(path):
+    # kernel/drivers/net/e1000e/e1000e.ko.zst -> e1000e; the kernel reports
+    # dashes in module names as underscores
+    return os.path.basename(path).split(".ko", 1)[0].replace("-", "_")
+
+
+def read_proc_modules(path=PROC_MODULES):
+    # name size refcount used-by state address
+    modules = {}
+    try:
+        with open(path) as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) < 5:
+                    continue
+                used_by = [m for m in parts[3].split(",") if m and m != "-"]
+                modules[parts[0]] = {
                     "name": parts[0],
-                    "size": int(parts[1]) if parts[1].isdigit() else parts[1],
+                    "size": int(parts[1]),
                     "used_by_count": int(parts[2]) if parts[2].isdigit() else 0,
-                    "dependencies": parts[3].split(',') if len(parts) > 3 and parts[3] != '-' else []
+                    "used_by": used_by,
+                    "state": parts[4],
                 }
-                modules.append(module_data)
-        kernelmods["modules_structured"] = modules
-        
-        # Get detailed info for critical/commonly problematic modules
-        critical_modules = ["nvidia", "amdgpu", "i915", "nouveau", "radeon", "iwlwifi", "ath9k", "rtw88", "r8169", "e1000e"]
-        module_details = {}
-        
-        for module in critical_modules:
-            # Check if module is loaded
-            if any(m["name"] == module for m in modules):
-                try:
-                    modinfo = subprocess.run(["modinfo", module], capture_output=True, text=True)
-                    if modinfo.returncode == 0:
-                        module_details[module] = modinfo.stdout
-                except Exception:
-                    continue
-        
-        kernelmods["critical_module_details"] = module_details
-        
-        # Get kernel version
-        try:
-            uname = subprocess.run(["uname", "-r"], capture_output=True, text=True)
-            kernelmods["kernel_version"] = uname.stdout.strip()
-        except Exception:
-            kernelmods["kernel_version"] = "N/A"
-            
-        # Get module loading configuration
+    except FileNotFoundError:
+        # Kernels built without module support
+        pass
+    return modules
+
+
+def read_sys_module(name, base=SYS_MODULE):
+    path = os.path.join(base, name)
+    info = {}
+    for field in ("version", "srcversion", "taint"):
+        value = _read(os.path.join(path, field))
+        if value:
+            info[field] = value
+    parameters = {}
+    for param in _listdir(os.path.join(path, "parameters")):
+        # Some parameters are write-only or need root
+        value = _read(os.path.join(path, "parameters", param))
+        if value is not None:
+            parameters[param] = value
+    info["parameters"] = parameters
+    return info
+
+
+class ModuleIndex:
+    # Per-release metadata from modules.dep and modules.alias, which can be
+    # several megabytes. Entries are cached per release and file mtimes, and
+    # the files are only read, in one pass each, for modules not seen before.
+    def __init__(self, release, base=MODULES_DIR):
+        self.root = os.path.join(base, release)
+        self.modules = {}
         try:
-            if shutil.which("find"):
-                # Look for module configuration files
-                modconf = subprocess.run(
-                    ["find", "/etc/modprobe.d/", "-name", "*.conf", "-type", "f"],
-                    capture_output=True, text=True
+            self.mtimes = [
+                os.stat(os.path.join(self.root, fname)).st_mtime_ns
+                for fname in ("modules.dep", "modules.alias")
+            ]
+        except OSError:
+            self.mtimes = None
+            return
+        self.cache_name = release + ".json"
+        cached = read_json("kernelmods", self.cache_name) or {}
+        if (cached.get("root"), cached.get("mtimes")) == (self.root, self.mtimes):
+            self.modules = cached["modules"]
+
+    def lookup(self, names):
+        # Returns {name: {"filename", "depends", "aliases"} or None}
+        if self.mtimes is None:
+            return {}
+        missing = set(names) - set(self.modules)
+        if missing:
+            found = self._scan(missing)
+            for name in missing:
+                self.modules[name] = found.get(name)
+            self._save()
+        return {name: self.modules[name] for name in names}
+
+    def _scan(self, missing):
+        found = {}
+        with open(os.path.join(self.root, "modules.dep")) as f:
+            for line in f:
+                path, _, depends = line.partition(":")
+                name = _module_name(path)
+                if name in missing:
+                    found[name] = {
+                        "filename": path,
+                        "depends": [_module_name(d) for d in depends.split()],
+                        "aliases": [],
+                    }
+        if found:
+            with open(os.path.join(self.root, "modules.alias")) as f:
+                for line in f:
+                    # alias pci:v00008086d000015B8sv*sd*bc*sc*i* e1000e
+                    parts = line.split()
+                    if len(parts) == 3 and parts[2] in found:
+                        found[parts[2]]["aliases"].append(parts[1])
+        return found
+
+    def _save(self):
+        cached = {"root": self.root, "mtimes": self.mtimes, "modules": self.modules}
+        write_json("kernelmods", self.cache_name, cached)
+
+
+def modprobe_configs(path=MODPROBE_DIR):
+    configs = []
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for fname in sorted(files):
+            if fname.endswith(".conf"):
+                configs.append(os.path.join(root, fname))
+    return configs
+
+
+def collect():
+    kernelmods = {}
+    try:
+        release = os.uname().release
+        kernelmods["kernel_version"] = release
+        loaded = read_proc_modules()
+        # Dependencies are the inverse of "used by"
+        depends = {name: [] for name in loaded}
+        for name, module in loaded.items():
+            for user in module["used_by"]:
+                if user in depends:
+                    depends[user].append(name)
+        index = ModuleIndex(release)
+        files = index.lookup(loaded) if loaded else {}
+        modules = []
+        for name, module in sorted(loaded.items()):
+            module["dependencies"] = sorted(depends[name])
+            module["filename"] = (files.get(name) or {}).get("filename")
+            module.update(read_sys_module(name))
+            modules.append(module)
+        kernelmods["modules_structured"] = modules
+
+        # Built into the kernel: listed in /sys/module but not loadable
+        builtin = []
+        for name in _listdir(SYS_MODULE):
+            if name not in loaded:
+                builtin.append(dict(name=name, **read_sys_module(name)))
+        kernelmods["builtin_modules"] = builtin
+
+        details = {}
+        for name in CRITICAL_MODULES:
+            if name in loaded:
+                module = loaded[name]
+                details[name] = dict(
+                    files.get(name) or {},
+                    version=module.get("version"),
+                    srcversion=module.get("srcversion"),
+                    parameters=module["parameters"],
                 )
-                if modconf.returncode == 0:
-                    kernelmods["modprobe_configs"] = modconf.stdout.strip().split('\n')
-        except Exception:
-            pass
-            
+        kernelmods["critical_module_details"] = details
+        kernelmods["modprobe_configs"] = modprobe_configs()
     except Exception as e:
         kernelmods["error"] = str(e)
-    
-    return kernelmods
\ No newline at end of file
+    return kernelmods
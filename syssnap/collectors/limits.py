@@ -1,4 +1,4 @@
-import subprocess
+from utils.shell import run
 import os
 
 
@@ -6,7 +6,7 @@ def collect():
     limits = {}
     try:
         # Get current shell limits with ulimit -a
-        ulimit = subprocess.run(["ulimit", "-a"], capture_output=True, text=True, shell=True)
+        ulimit = run(["ulimit", "-a"], shell=True)
         limits["ulimit"] = ulimit.stdout
         
         # Parse ulimit output for structured data
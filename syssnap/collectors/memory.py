@@ -1,11 +1,13 @@
+from utils.shell import read_file
+
+
 def collect():
     meminfo = {}
     try:
-        with open("/proc/meminfo") as f:
-            for line in f:
-                if ":" in line:
-                    key, val = [s.strip() for s in line.split(":", 1)]
-                    meminfo[key] = val
+        for line in read_file("/proc/meminfo").splitlines():
+            if ":" in line:
+                key, val = [s.strip() for s in line.split(":", 1)]
+                meminfo[key] = val
     except Exception as e:
         meminfo["error"] = str(e)
     return meminfo
@@ -1,38 +1,38 @@
-import subprocess
 import os
+import re
+from utils.shell import run, read_file
 
 
 def collect():
     mounts = {}
     try:
         # Get current mounts using the mount command
-        mount_cmd = subprocess.run(["mount"], capture_output=True, text=True)
+        mount_cmd = run(["mount"])
         if mount_cmd.returncode == 0:
             mounts["mount_command"] = mount_cmd.stdout
         
         # Parse /proc/mounts for detailed mount information
         try:
-            with open("/proc/mounts") as f:
-                proc_mounts = f.read()
-                mounts["proc_mounts"] = proc_mounts
-                
-                # Parse into structured format
-                structured_mounts = []
-                for line in proc_mounts.strip().split('\n'):
-                    if line:
-                        parts = line.split()
-                        if len(parts) >= 6:
-                            mount_info = {
-                                "device": parts[0],
-                                "mountpoint": parts[1], 
-                                "filesystem": parts[2],
-                                "options": parts[3].split(','),
-                                "dump": parts[4],
-                                "pass": parts[5]
-                            }
-                            structured_mounts.append(mount_info)
-                mounts["mounts_structured"] = structured_mounts
-                
+            proc_mounts = read_file("/proc/mounts")
+            mounts["proc_mounts"] = proc_mounts
+            
+            # Parse into structured format
+            structured_mounts = []
+            for line in proc_mounts.strip().split('\n'):
+                if line:
+                    parts = line.split()
+                    if len(parts) >= 6:
+                        mount_info = {
+                            "device": parts[0],
+                            "mountpoint": parts[1], 
+                            "filesystem": parts[2],
+                            "options": parts[3].split(','),
+                            "dump": parts[4],
+                            "pass": parts[5]
+                        }
+                        structured_mounts.append(mount_info)
+            mounts["mounts_structured"] = structured_mounts
+            
         except Exception as e:
             mounts["proc_mounts_error"] = str(e)
         
@@ -115,7 +115,7 @@ def collect():
         
         # Check disk usage for mounted filesystems
         try:
-            df_output = subprocess.run(["df", "-h"], capture_output=True, text=True)
+            df_output = run(["df", "-h"])
             if df_output.returncode == 0:
                 mounts["disk_usage"] = df_output.stdout
                 
@@ -143,19 +143,18 @@ def collect():
         
         # Check for filesystem errors in dmesg
         try:
-            dmesg_fs = subprocess.run(
-                ["dmesg", "|", "grep", "-i", "-E", "(filesystem|mount|ext[234]|xfs|btrfs)"],
-                capture_output=True, text=True, shell=True
-            )
-            if dmesg_fs.returncode == 0 and dmesg_fs.stdout.strip():
-                mounts["filesystem_dmesg"] = dmesg_fs.stdout
+            # Same invocation as the logs collector so the probe is shared
+            dmesg = run(["dmesg", "--time-format=iso"])
+            fs_pattern = re.compile(r"filesystem|mount|ext[234]|xfs|btrfs", re.IGNORECASE)
+            fs_lines = [line for line in dmesg.stdout.splitlines() if fs_pattern.search(line)]
+            if dmesg.returncode == 0 and fs_lines:
+                mounts["filesystem_dmesg"] = "\n".join(fs_lines) + "\n"
         except Exception:
             pass
         
         # Get mount namespaces info (for containers)
         try:
-            with open("/proc/self/mountinfo") as f:
-                mounts["mountinfo"] = f.read()
+            mounts["mountinfo"] = read_file("/proc/self/mountinfo")
         except Exception as e:
             mounts["mountinfo_error"] = str(e)
         
@@ -1,178 +1,383 @@
-import subprocess
-import shutil
+import heapq
 import os
+import socket
+import sys
+import time
+from utils.shell import read_file
 
+TCP_STATES = {
+    b"01": "ESTABLISHED",
+    b"02": "SYN_SENT",
+    b"03": "SYN_RECV",
+    b"04": "FIN_WAIT1",
+    b"05": "FIN_WAIT2",
+    b"06": "TIME_WAIT",
+    b"07": "CLOSE",
+    b"08": "CLOSE_WAIT",
+    b"09": "LAST_ACK",
+    b"0A": "LISTEN",
+    b"0B": "CLOSING",
+    b"0C": "NEW_SYN_RECV",
+}
+UDP_STATES = {b"01": "ESTABLISHED", b"07": "UNCONN"}
 
-def collect():
-    netconns = {}
-    try:
-        # Use ss (preferred) for network connections
-        if shutil.which("ss"):
-            try:
-                # TCP connections with process info
-                ss_tcp = subprocess.run(
-                    ["ss", "-tulpn"], 
-                    capture_output=True, text=True
-                )
-                if ss_tcp.returncode == 0:
-                    netconns["ss_tcp_udp"] = ss_tcp.stdout
-                
-                # More detailed TCP state information
-                ss_detailed = subprocess.run(
-                    ["ss", "-tulpn", "-e", "-m"],
-                    capture_output=True, text=True
-                )
-                if ss_detailed.returncode == 0:
-                    netconns["ss_detailed"] = ss_detailed.stdout
-                
-                # Parse ss output for structured data
-                connections = []
-                lines = ss_tcp.stdout.strip().split('\n')[1:]  # Skip header
-                for line in lines:
-                    parts = line.split()
-                    if len(parts) >= 5:
-                        conn_info = {
-                            "protocol": parts[0],
-                            "state": parts[1] if parts[0] == "tcp" else "N/A",
-                            "recv_q": parts[1] if parts[0] == "udp" else parts[2],
-                            "send_q": parts[2] if parts[0] == "udp" else parts[3], 
-                            "local_address": parts[3] if parts[0] == "udp" else parts[4],
-                            "peer_address": parts[4] if parts[0] == "udp" else parts[5] if len(parts) > 5 else "N/A",
-                            "process": parts[-1] if "pid=" in parts[-1] else "N/A"
-                        }
-                        
-                        # Extract process name and PID
-                        if "pid=" in conn_info["process"]:
-                            try:
-                                process_part = conn_info["process"]
-                                if "users:((" in process_part:
-                                    # Parse format: users:(("process_name",pid=1234,fd=5))
-                                    process_info = process_part.split("((")[1].split("))")[0]
-                                    parts = process_info.split(",")
-                                    conn_info["process_name"] = parts[0].strip('"')
-                                    for part in parts:
-                                        if "pid=" in part:
-                                            conn_info["pid"] = part.split("=")[1]
-                                        elif "fd=" in part:
-                                            conn_info["fd"] = part.split("=")[1]
-                            except (IndexError, ValueError):
-                                pass
-                        
-                        connections.append(conn_info)
-                
-                netconns["connections_structured"] = connections
-                
-            except Exception as e:
-                netconns["ss_error"] = str(e)
-        
-        # Fallback to netstat if ss is not available
-        elif shutil.which("netstat"):
-            try:
-                netstat = subprocess.run(
-                    ["netstat", "-tulpn"],
-                    capture_output=True, text=True
-                )
-                if netstat.returncode == 0:
-                    netconns["netstat"] = netstat.stdout
-            except Exception as e:
-                netconns["netstat_error"] = str(e)
-        
-        # Get raw socket information from /proc/net/
-        proc_net_files = ["tcp", "tcp6", "udp", "udp6"]
-        proc_net_data = {}
-        
-        for net_file in proc_net_files:
+SUSPICIOUS_PORTS = {4444, 5555, 6666, 31337, 12345}
+TOP_PEERS = 10
+MAX_LISTED = 100  # per-connection entries kept in aggregate mode
+LITTLE_ENDIAN = sys.byteorder == "little"
+
+
+# Counters worth keeping from /proc/net/snmp and /proc/net/netstat. Gauges
+# (CurrEstab) are reported as-is; everything else also gets a rate when
+# sampling.
+SNMP_FIELDS = {
+    "Tcp": (
+        "ActiveOpens",
+        "PassiveOpens",
+        "AttemptFails",
+        "EstabResets",
+        "CurrEstab",
+        "InSegs",
+        "OutSegs",
+        "RetransSegs",
+        "InErrs",
+        "OutRsts",
+    ),
+    "Udp": (
+        "InDatagrams",
+        "OutDatagrams",
+        "NoPorts",
+        "InErrors",
+        "RcvbufErrors",
+        "SndbufErrors",
+    ),
+    "TcpExt": (
+        "ListenOverflows",
+        "ListenDrops",
+        "TCPReqQFullDrop",
+        "TCPBacklogDrop",
+        "SyncookiesSent",
+        "TCPSynRetrans",
+        "TCPTimeouts",
+        "TCPLostRetransmit",
+        "TCPAbortOnTimeout",
+    ),
+}
+GAUGES = {"CurrEstab"}
+
+
+class Socket:
+    # One row of /proc/net/{tcp,udp}{,6}; kept as slots rather than dicts
+    # because load balancers can have hundreds of thousands of them
+    __slots__ = (
+        "protocol",
+        "state",
+        "local_ip",
+        "local_port",
+        "peer_ip",
+        "peer_port",
+        "recv_q",
+        "send_q",
+        "inode",
+    )
+
+    @property
+    def local_address(self):
+        return f"{self.local_ip}:{self.local_port or '*'}"
+
+    @property
+    def peer_address(self):
+        return f"{self.peer_ip}:{self.peer_port or '*'}"
+
+
+def _decode_ip(hexaddr, cache):
+    # The kernel prints addresses as host-endian 32-bit words, so they are
+    # already in network order on big-endian hosts
+    ip = cache.get(hexaddr)
+    if ip is None:
+        raw = bytes.fromhex(hexaddr.decode("ascii"))
+        if LITTLE_ENDIAN:
+            raw = b"".join(raw[i : i + 4][::-1] for i in range(0, len(raw), 4))
+        if len(raw) == 4:
+            ip = socket.inet_ntop(socket.AF_INET, raw)
+        else:
+            ip = "[" + socket.inet_ntop(socket.AF_INET6, raw) + "]"
+        cache[hexaddr] = ip
+    return ip
+
+
+def read_sockets(tables=("tcp", "tcp6", "udp", "udp6")):
+    sockets = []
+    cache = {}
+    for table in tables:
+        try:
+            with open(f"/proc/net/{table}", "rb") as f:
+                lines = f.read().splitlines()
+        except OSError:
+            continue
+        protocol = table.rstrip("6")
+        states = TCP_STATES if protocol == "tcp" else UDP_STATES
+        for line in lines[1:]:
+            fields = line.split()
+            if len(fields) < 10:
+                continue
+            local_ip, _, local_port = fields[1].partition(b":")
+            peer_ip, _, peer_port = fields[2].partition(b":")
+            tx_queue, _, rx_queue = fields[4].partition(b":")
+            sock = Socket()
+            sock.protocol = protocol
+            sock.state = states.get(fields[3]) or fields[3].decode()
+            sock.local_ip = _decode_ip(local_ip, cache)
+            sock.local_port = int(local_port, 16)
+            sock.peer_ip = _decode_ip(peer_ip, cache)
+            sock.peer_port = int(peer_port, 16)
+            sock.recv_q = int(rx_queue, 16)
+            sock.send_q = int(tx_queue, 16)
+            sock.inode = int(fields[9])
+            sockets.append(sock)
+    return sockets
+
+
+def socket_owners(inodes):
+    # One pass over /proc/*/fd mapping socket inodes to (name, pid, fd)
+    owners = {}
+    with os.scandir("/proc") as procs:
+        for proc in procs:
+            if not proc.name.isdigit():
+                continue
+            name = None
             try:
-                with open(f"/proc/net/{net_file}") as f:
-                    proc_net_data[net_file] = f.read()
-            except Exception as e:
-                proc_net_data[f"{net_file}_error"] = str(e)
-        
-        if proc_net_data:
-            netconns["proc_net"] = proc_net_data
-        
-        # Analyze connections for common issues
-        if "connections_structured" in netconns:
-            analysis = {
-                "listening_ports": [],
-                "established_connections": [],
-                "port_conflicts": [],
-                "high_connection_counts": {},
-                "suspicious_connections": []
+                with os.scandir(proc.path + "/fd") as fds:
+                    for fd in fds:
+                        try:
+                            target = os.readlink(fd.path)
+                        except OSError:
+                            continue
+                        if not target.startswith("socket:["):
+                            continue
+                        inode = int(target[8:-1])
+                        if inode not in inodes:
+                            continue
+                        if name is None:
+                            with open(proc.path + "/comm") as f:
+                                name = f.read().rstrip("\n")
+                        owners.setdefault(inode, []).append(
+                            (name, int(proc.name), int(fd.name))
+                        )
+            except OSError:
+                continue
+    return owners
+
+
+def connection_record(sock, owners):
+    record = {
+        "protocol": sock.protocol,
+        "state": sock.state,
+        "recv_q": sock.recv_q,
+        "send_q": sock.send_q,
+        "local_address": sock.local_address,
+        "peer_address": sock.peer_address,
+        "process": "N/A",
+    }
+    users = owners.get(sock.inode)
+    if users:
+        # Same shape as the process column of ss -p
+        record["process"] = "users:(%s)" % ",".join(
+            f'("{name}",pid={pid},fd={fd})' for name, pid, fd in users
+        )
+        record["process_name"], record["pid"], record["fd"] = users[0]
+    return record
+
+
+def read_sockstat(path):
+    # "TCP: inuse 4 orphan 0 tw 7 alloc 4 mem 0" -> {"TCP": {"inuse": 4, ...}}
+    stats = {}
+    with open(path) as f:
+        for line in f:
+            proto, _, rest = line.partition(":")
+            values = rest.split()
+            stats[proto] = {
+                values[i]: int(values[i + 1]) for i in range(0, len(values) - 1, 2)
             }
-            
-            port_usage = {}  # Track which processes use which ports
-            
-            for conn in netconns["connections_structured"]:
-                local_addr = conn.get("local_address", "")
-                state = conn.get("state", "")
-                process = conn.get("process_name", "unknown")
-                
-                # Extract port from address
-                if ":" in local_addr:
-                    try:
-                        port = local_addr.split(":")[-1]
-                        
-                        # Track listening ports
-                        if state == "LISTEN" or conn["protocol"] == "udp":
-                            analysis["listening_ports"].append({
-                                "port": port,
-                                "protocol": conn["protocol"],
-                                "process": process,
-                                "address": local_addr
-                            })
-                            
-                            # Check for port conflicts
-                            port_key = f"{conn['protocol']}:{port}"
-                            if port_key in port_usage:
-                                port_usage[port_key].append(process)
-                            else:
-                                port_usage[port_key] = [process]
-                        
-                        # Track established connections
-                        elif state == "ESTABLISHED":
-                            analysis["established_connections"].append({
-                                "local": local_addr,
-                                "remote": conn.get("peer_address", ""),
-                                "process": process
-                            })
-                        
-                    except (ValueError, IndexError):
-                        continue
-            
-            # Identify port conflicts
-            for port_key, processes in port_usage.items():
-                if len(processes) > 1:
-                    analysis["port_conflicts"].append({
-                        "port": port_key,
-                        "processes": processes
+    return stats
+
+
+def read_snmp_counters():
+    # snmp and netstat come as header/value line pairs per protocol
+    counters = {}
+    for path in ("/proc/net/snmp", "/proc/net/netstat"):
+        try:
+            with open(path) as f:
+                lines = f.read().splitlines()
+        except OSError:
+            continue
+        for header, values in zip(lines[::2], lines[1::2]):
+            proto, _, names = header.partition(":")
+            wanted = SNMP_FIELDS.get(proto)
+            if not wanted:
+                continue
+            row = dict(zip(names.split(), values.partition(":")[2].split()))
+            counters[proto] = {name: int(row[name]) for name in wanted if name in row}
+    return counters
+
+
+def read_counters():
+    counters = {}
+    for name in ("sockstat", "sockstat6"):
+        try:
+            counters[name] = read_sockstat(f"/proc/net/{name}")
+        except OSError:
+            pass
+    counters.update(read_snmp_counters())
+    return counters
+
+
+def counter_rates(before, after, elapsed):
+    rates = {}
+    for proto in SNMP_FIELDS:
+        if proto not in before or proto not in after:
+            continue
+        rates[proto] = {
+            name: round((after[proto][name] - before[proto][name]) / elapsed, 2)
+            for name in after[proto]
+            if name in before[proto] and name not in GAUGES
+        }
+    return rates
+
+
+def analyze(sockets, owners, detail=False):
+    # Single pass over the socket table. Connections are aggregated by
+    # (state, process, local port) rather than listed one by one; local
+    # ports that nothing listens on are ephemeral client ports and are
+    # folded into "*" so outbound connections do not blow up the groups.
+    analysis = {
+        "total": len(sockets),
+        "by_state": {},
+        "listening_ports": [],
+        "port_conflicts": [],
+        "high_connection_counts": {},
+        "suspicious_connections": [],
+        "connection_groups": [],
+        "top_peers": [],
+    }
+    if detail:
+        analysis["established_connections"] = []
+
+    def process_of(sock):
+        users = owners.get(sock.inode)
+        return users[0][0] if users else "unknown"
+
+    port_usage = {}  # Track which processes use which ports
+    for sock in sockets:
+        if sock.state in ("LISTEN", "UNCONN"):
+            process = process_of(sock)
+            analysis["listening_ports"].append({
+                "port": str(sock.local_port),
+                "protocol": sock.protocol,
+                "process": process,
+                "address": sock.local_address
+            })
+            port_usage.setdefault((sock.protocol, sock.local_port), []).append(process)
+
+    by_state = analysis["by_state"]
+    groups = {}
+    peers = {}
+    process_counts = {}
+    suspicious = 0
+    for sock in sockets:
+        state = sock.state
+        process = process_of(sock)
+        by_state[state] = by_state.get(state, 0) + 1
+        process_counts[process] = process_counts.get(process, 0) + 1
+
+        local_port = sock.local_port
+        if (sock.protocol, local_port) not in port_usage:
+            local_port = "*"
+        key = (state, process, local_port)
+        groups[key] = groups.get(key, 0) + 1
+
+        if state not in ("LISTEN", "UNCONN"):
+            peers[sock.peer_ip] = peers.get(sock.peer_ip, 0) + 1
+            if detail and state == "ESTABLISHED":
+                analysis["established_connections"].append({
+                    "local": sock.local_address,
+                    "remote": sock.peer_address,
+                    "process": process
+                })
+
+        # Look for suspicious connections (common malware ports, etc.)
+        for port in (sock.local_port, sock.peer_port):
+            if port in SUSPICIOUS_PORTS:
+                suspicious += 1
+                if detail or suspicious <= MAX_LISTED:
+                    analysis["suspicious_connections"].append({
+                        "connection": connection_record(sock, owners),
+                        "reason": f"Suspicious port {port}"
                     })
-            
-            # Count connections per process
-            process_counts = {}
-            for conn in netconns["connections_structured"]:
-                process = conn.get("process_name", "unknown")
-                process_counts[process] = process_counts.get(process, 0) + 1
-            
-            # Flag processes with high connection counts
-            for process, count in process_counts.items():
-                if count > 50:  # Arbitrary threshold
-                    analysis["high_connection_counts"][process] = count
-            
-            # Look for suspicious connections (common malware ports, etc.)
-            suspicious_ports = ["4444", "5555", "6666", "31337", "12345"]
-            for conn in netconns["connections_structured"]:
-                local_addr = conn.get("local_address", "")
-                peer_addr = conn.get("peer_address", "")
-                
-                for susp_port in suspicious_ports:
-                    if susp_port in local_addr or susp_port in peer_addr:
-                        analysis["suspicious_connections"].append({
-                            "connection": conn,
-                            "reason": f"Suspicious port {susp_port}"
-                        })
-            
-            netconns["analysis"] = analysis
+                break
+
+    if suspicious > len(analysis["suspicious_connections"]):
+        analysis["suspicious_total"] = suspicious
+
+    # Identify port conflicts
+    for (protocol, port), processes in port_usage.items():
+        if len(processes) > 1:
+            analysis["port_conflicts"].append({
+                "port": f"{protocol}:{port}",
+                "processes": processes
+            })
+
+    # Flag processes with high connection counts
+    for process, count in process_counts.items():
+        if count > 50:  # Arbitrary threshold
+            analysis["high_connection_counts"][process] = count
+
+    analysis["connection_groups"] = [
+        {"state": state, "process": process, "local_port": port, "count": count}
+        for (state, process, port), count in sorted(
+            groups.items(), key=lambda g: g[1], reverse=True
+        )
+    ]
+    analysis["top_peers"] = [
+        {"peer": peer, "count": count}
+        for peer, count in heapq.nlargest(
+            TOP_PEERS, peers.items(), key=lambda p: p[1]
+        )
+    ]
+    return analysis
+
+
+def collect(detail=False, sample_interval=None):
+    netconns = {}
+    try:
+        # Kernel socket counters: cheap enough to read twice and turn into
+        # rates, with the socket table parsed in between
+        try:
+            started = time.monotonic()
+            counters = read_counters()
+        except Exception as e:
+            netconns["counters_error"] = str(e)
+            counters = None
+            sample_interval = None
+
+        # Parse the kernel socket tables directly instead of forking ss
+        try:
+            sockets = read_sockets()
+            owners = socket_owners({sock.inode for sock in sockets if sock.inode})
+        except Exception as e:
+            netconns["proc_net_error"] = str(e)
+            sockets = []
+            owners = {}
+
+        # The full per-connection list is only included on request
+        if detail:
+            netconns["connections_structured"] = [
+                connection_record(sock, owners) for sock in sockets
+            ]
+
+        # Analyze connections for common issues
+        if sockets:
+            netconns["analysis"] = analyze(sockets, owners, detail=detail)
         
         # Check for common network service ports
         common_services = {
@@ -209,27 +414,24 @@ def collect():
         
         # Get network interface statistics for context
         try:
-            with open("/proc/net/dev") as f:
-                netconns["interface_stats"] = f.read()
+            netconns["interface_stats"] = read_file("/proc/net/dev")
         except Exception as e:
             netconns["interface_stats_error"] = str(e)
         
-        # Check for TIME_WAIT connections (can indicate connection issues)
-        if shutil.which("ss"):
-            try:
-                time_wait = subprocess.run(
-                    ["ss", "-tan", "state", "time-wait"],
-                    capture_output=True, text=True
-                )
-                if time_wait.returncode == 0:
-                    time_wait_count = len(time_wait.stdout.strip().split('\n')) - 1
-                    if time_wait_count > 100:  # High number of TIME_WAIT connections
-                        netconns["time_wait_warning"] = {
-                            "count": time_wait_count,
-                            "data": time_wait.stdout
-                        }
-            except Exception:
-                pass
+        if counters is not None:
+            if sample_interval:
+                time.sleep(max(0.0, sample_interval - (time.monotonic() - started)))
+                elapsed = time.monotonic() - started
+                later = read_counters()
+                netconns["counter_rates"] = counter_rates(counters, later, elapsed)
+                netconns["counter_rates"]["interval"] = round(elapsed, 3)
+                counters = later
+            netconns["counters"] = counters
+
+            # Check for TIME_WAIT connections (can indicate connection issues)
+            time_wait_count = counters.get("sockstat", {}).get("TCP", {}).get("tw", 0)
+            if time_wait_count > 100:  # High number of TIME_WAIT connections
+                netconns["time_wait_warning"] = {"count": time_wait_count}
                 
     except Exception as e:
         netconns["error"] = str(e)
@@ -1,26 +1,25 @@
-import subprocess
+from utils.shell import run, read_file
 
 
 def collect():
     net_info = {}
     try:
         # IP addresses and interfaces
-        ip = subprocess.run(["ip", "a"], capture_output=True, text=True)
+        ip = run(["ip", "a"])
         net_info["ip"] = ip.stdout
 
         # Routing table
-        route = subprocess.run(["ip", "route"], capture_output=True, text=True)
+        route = run(["ip", "route"])
         net_info["route"] = route.stdout
 
         # DNS resolvers
         try:
-            with open("/etc/resolv.conf") as f:
-                net_info["resolv.conf"] = f.read()
+            net_info["resolv.conf"] = read_file("/etc/resolv.conf")
         except Exception:
             net_info["resolv.conf"] = "N/A"
 
         # Active connections
-        ss = subprocess.run(["ss", "-tulnp"], capture_output=True, text=True)
+        ss = run(["ss", "-tulpn"])
         net_info["active_connections"] = ss.stdout
 
     except Exception as e:
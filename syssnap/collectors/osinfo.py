@@ -1,5 +1,5 @@
 import platform
-import subprocess
+from utils.shell import run
 
 
 def collect():
@@ -21,7 +21,7 @@ def collect():
         except Exception:
             os_info["os-release"] = "N/A"
 
-        uptime = subprocess.run(["uptime", "-p"], capture_output=True, text=True)
+        uptime = run(["uptime", "-p"])
         os_info["uptime"] = uptime.stdout.strip()
 
     except Exception as e:
@@ -1,24 +1,138 @@
-import subprocess
+import os
 import shutil
+from utils.shell import run
+
+DPKG_STATUS = "/var/lib/dpkg/status"
+PACMAN_LOCAL = "/var/lib/pacman/local"
+RPM_QUERYFORMAT = (
+    "%{NAME}\t%|EPOCH?{%{EPOCH}:}:{}|%{VERSION}-%{RELEASE}\t%{ARCH}\n"
+)
+
+CACHE = {
+    "ttl": 86400,
+    "paths": [
+        DPKG_STATUS,
+        "/var/lib/rpm",
+        "/var/lib/rpm/rpmdb.sqlite",
+        "/var/lib/rpm/Packages",
+        PACMAN_LOCAL,
+    ],
+}
+
+_DPKG_FIELDS = {
+    b"Package": "name",
+    b"Version": "version",
+    b"Architecture": "arch",
+    b"Status": "status",
+}
+
+
+def _dpkg_record(fields):
+    # Status is "<want> <flag> <status>", e.g. "install ok installed" or
+    # "deinstall ok config-files"; a non-default want (hold) is kept
+    want, _, status = fields.get("status", "").partition(" ok ")
+    record = {
+        "name": fields["name"],
+        "version": fields.get("version", ""),
+        "arch": fields.get("arch", ""),
+        "status": status or fields.get("status", ""),
+    }
+    if want not in ("install", ""):
+        record["want"] = want
+    return record
+
+
+def read_dpkg(path=DPKG_STATUS):
+    # Streams the status file, keeping only the fields of interest, so the
+    # long Description and Conffiles blocks are never held in memory
+    records = []
+    fields = {}
+    with open(path, "rb") as f:
+        for line in f:
+            if line[:1] in (b" ", b"\t"):
+                continue
+            if line == b"\n":
+                if "name" in fields:
+                    records.append(_dpkg_record(fields))
+                fields = {}
+                continue
+            key, sep, value = line.partition(b":")
+            name = _DPKG_FIELDS.get(key)
+            if name and sep:
+                fields[name] = value.strip().decode("utf-8", "replace")
+    if "name" in fields:
+        records.append(_dpkg_record(fields))
+    return records
+
+
+def read_pacman(path=PACMAN_LOCAL):
+    records = []
+    with os.scandir(path) as it:
+        for entry in it:
+            if not entry.is_dir():
+                continue
+            try:
+                with open(os.path.join(entry.path, "desc"), encoding="utf-8") as f:
+                    lines = f.read().splitlines()
+            except OSError:
+                continue
+            fields = {}
+            for i, line in enumerate(lines[:-1]):
+                if line in ("%NAME%", "%VERSION%", "%ARCH%", "%REASON%"):
+                    fields[line.strip("%")] = lines[i + 1]
+            if "NAME" in fields:
+                records.append(
+                    {
+                        "name": fields["NAME"],
+                        "version": fields.get("VERSION", ""),
+                        "arch": fields.get("ARCH", ""),
+                        # REASON 1: installed as a dependency
+                        "status": (
+                            "dependency" if fields.get("REASON") == "1" else "explicit"
+                        ),
+                    }
+                )
+    records.sort(key=lambda r: r["name"])
+    return records
+
+
+def read_rpm():
+    result = run(["rpm", "-qa", "--qf", RPM_QUERYFORMAT])
+    records = []
+    for line in result.stdout.splitlines():
+        parts = line.split("\t")
+        if len(parts) >= 3 and parts[0]:
+            records.append(
+                {
+                    "name": parts[0],
+                    "version": parts[1],
+                    "arch": parts[2],
+                    "status": "installed",
+                }
+            )
+    records.sort(key=lambda r: (r["name"], r["arch"], r["version"]))
+    return records
 
 
 def collect():
     pkgs = {}
     try:
-        # Try dpkg (Debian/Ubuntu)
-        if shutil.which("dpkg"):
-            dpkg = subprocess.run(["dpkg", "-l"], capture_output=True, text=True)
-            pkgs["dpkg"] = dpkg.stdout
-        # Try rpm (RHEL/Fedora)
+        # Read the package database directly where its format is stable;
+        # rpm's database is only read through rpm itself
+        if os.path.exists(DPKG_STATUS):
+            pkgs["manager"] = "dpkg"
+            records = read_dpkg()
         elif shutil.which("rpm"):
-            rpm = subprocess.run(["rpm", "-qa"], capture_output=True, text=True)
-            pkgs["rpm"] = rpm.stdout
-        # Try pacman (Arch)
-        elif shutil.which("pacman"):
-            pacman = subprocess.run(["pacman", "-Q"], capture_output=True, text=True)
-            pkgs["pacman"] = pacman.stdout
+            pkgs["manager"] = "rpm"
+            records = read_rpm()
+        elif os.path.isdir(PACMAN_LOCAL):
+            pkgs["manager"] = "pacman"
+            records = read_pacman()
         else:
             pkgs["error"] = "No known package manager found"
+            return pkgs
+        pkgs["count"] = len(records)
+        pkgs["packages"] = records
     except Exception as e:
         pkgs["error"] = str(e)
     return pkgs
@@ -1,20 +1,228 @@
-import subprocess
+import heapq
+import os
+import pwd
+import resource
+import time
 
+TOP_N = 10
 
-def collect():
+CLK_TCK = os.sysconf("SC_CLK_TCK")
+PAGE_KB = os.sysconf("SC_PAGE_SIZE") // 1024
+
+
+def _read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def _boot_time():
+    with open("/proc/stat") as f:
+        for line in f:
+            if line.startswith("btime"):
+                return int(line.split()[1])
+    return 0
+
+
+def _user(uid, names):
+    name = names.get(uid)
+    if name is None:
+        try:
+            name = pwd.getpwuid(uid).pw_name
+        except KeyError:
+            name = str(uid)
+        names[uid] = name
+    return name
+
+
+def _euid(status):
+    # "Uid:\treal\teffective\tsaved\tfs". The owner of /proc/[pid] is not
+    # the process's uid: non-dumpable processes (setuid programs, ssh-agent)
+    # are owned by root.
+    start = status.find(b"\nUid:")
+    if start < 0:
+        return None
+    return int(status[start + 5 : status.index(b"\n", start + 1)].split()[1])
+
+
+def read_process(entry, btime, names):
+    # Returns None when the process exits between listing and reading
+    pid = int(entry.name)
+    path = entry.path
+    try:
+        uid = _euid(_read(path + "/status"))
+        stat = _read(path + "/stat")
+        cmdline = _read(path + "/cmdline")
+    except OSError:
+        return None
+    if uid is None:
+        return None
+    # comm may itself contain spaces and parentheses, so split on the last ")"
+    head, _, rest = stat.rpartition(b")")
+    fields = rest.split()
+    if len(fields) < 22:
+        return None
+    if cmdline:
+        cmd = cmdline.rstrip(b"\0").replace(b"\0", b" ").decode("utf-8", "replace")
+    else:
+        cmd = "[" + head.partition(b"(")[2].decode("utf-8", "replace") + "]"
+    return {
+        "pid": pid,
+        "ppid": int(fields[1]),
+        "uid": uid,
+        "user": _user(uid, names),
+        "state": fields[0].decode(),
+        "threads": int(fields[17]),
+        "rss_kb": int(fields[21]) * PAGE_KB,
+        "vsz_kb": int(fields[20]) // 1024,
+        "start_time": btime + int(fields[19]) // CLK_TCK,
+        "cpu_time": (int(fields[11]) + int(fields[12])) / CLK_TCK,
+        "cmd": cmd,
+    }
+
+
+def scan_processes():
+    btime = _boot_time()
+    names = {}
+    records = []
+    with os.scandir("/proc") as it:
+        for entry in it:
+            if not entry.name.isdigit():
+                continue
+            try:
+                record = read_process(entry, btime, names)
+            except ValueError:
+                continue
+            if record is not None:
+                records.append(record)
+    return records
+
+
+def _total_jiffies():
+    with open("/proc/stat") as f:
+        return sum(int(v) for v in f.readline().split()[1:])
+
+
+def _open(path):
+    try:
+        return os.open(path, os.O_RDONLY)
+    except OSError:
+        return None
+
+
+def _read_counters(stat_fd, io_fd):
+    # /proc files can be re-read in place, so a kept descriptor is pread()
+    # again instead of walking the path a second time
+    fields = os.pread(stat_fd, 4096, 0).rpartition(b")")[2].split()
+    ticks = int(fields[11]) + int(fields[12])
+    start = int(fields[19])
+    io = None
+    if io_fd is not None:
+        io = {}
+        for line in os.pread(io_fd, 4096, 0).splitlines():
+            key, _, value = line.partition(b":")
+            if key in (b"read_bytes", b"write_bytes"):
+                io[key] = int(value)
+    return ticks, start, io
+
+
+def _sample_pass(pid, handles, keep):
+    if handles is None:
+        handles = (_open(f"/proc/{pid}/stat"), _open(f"/proc/{pid}/io"))
+    counters = None
+    if handles[0] is not None:
+        try:
+            counters = _read_counters(*handles)
+        except (OSError, ValueError, IndexError):
+            pass
+    if counters is None or not keep:
+        for fd in handles:
+            if fd is not None:
+                os.close(fd)
+        return counters, None
+    return counters, handles
+
+
+def sample_activity(interval, scan=None, top_n=TOP_N):
+    # Two passes over /proc/[pid]/stat and io around ``interval``. Between
+    # them ``scan`` is run, so the full process table is read while waiting.
+    # Descriptors from the first pass are kept (within the open file limit)
+    # and re-read in the second, which only visits PIDs seen in the first.
+    budget = resource.getrlimit(resource.RLIMIT_NOFILE)[0] - 256
+    first = {}
+    handles = {}
+    t0 = time.monotonic()
+    total0 = _total_jiffies()
+    with os.scandir("/proc") as it:
+        for entry in it:
+            if not entry.name.isdigit():
+                continue
+            pid = int(entry.name)
+            counters, kept = _sample_pass(pid, None, budget > 0)
+            if counters is None:
+                continue
+            first[pid] = counters
+            if kept:
+                handles[pid] = kept
+                budget -= 2
+
+    records = scan() if scan else []
+    time.sleep(max(0.0, interval - (time.monotonic() - t0)))
+
+    elapsed = time.monotonic() - t0
+    total_delta = max(1, _total_jiffies() - total0)
+    ncpu = os.cpu_count() or 1
+    cpu = []
+    io = []
+    for pid, (ticks, start, io0) in first.items():
+        counters, _ = _sample_pass(pid, handles.get(pid), False)
+        # Skip processes that exited, or whose PID was reused, in between
+        if counters is None or counters[1] != start:
+            continue
+        cpu.append((pid, (counters[0] - ticks) * ncpu * 100.0 / total_delta))
+        if io0 is not None and counters[2] is not None:
+            read = (counters[2][b"read_bytes"] - io0[b"read_bytes"]) / elapsed
+            write = (counters[2][b"write_bytes"] - io0[b"write_bytes"]) / elapsed
+            io.append((pid, read, write))
+
+    cmds = {r["pid"]: r["cmd"] for r in records}
+    return records, {
+        "interval": round(elapsed, 3),
+        "top_by_cpu": [
+            {"pid": pid, "cpu_percent": round(pct, 1), "cmd": cmds.get(pid)}
+            for pid, pct in heapq.nlargest(top_n, cpu, key=lambda c: c[1])
+            if pct > 0
+        ],
+        "top_by_io": [
+            {
+                "pid": pid,
+                "read_bytes_per_sec": int(read),
+                "write_bytes_per_sec": int(write),
+                "cmd": cmds.get(pid),
+            }
+            for pid, read, write in heapq.nlargest(
+                top_n, io, key=lambda i: i[1] + i[2]
+            )
+            if read + write > 0
+        ],
+    }
+
+
+def collect(sample_interval=None):
     procs = {}
     try:
-        # Running processes (ps aux)
-        ps = subprocess.run(["ps", "aux"], capture_output=True, text=True)
-        procs["ps_aux"] = ps.stdout
-
-        # Top 10 by memory
-        top = subprocess.run(
-            ["ps", "-eo", "pid,ppid,user,cmd,%mem,%cpu", "--sort=-%mem"],
-            capture_output=True,
-            text=True,
-        )
-        procs["top_by_mem"] = "\n".join(top.stdout.splitlines()[:12])
+        if sample_interval:
+            records, procs["sample"] = sample_activity(
+                sample_interval, scan=scan_processes
+            )
+        else:
+            records = scan_processes()
+        procs["count"] = len(records)
+        procs["processes"] = records
+        # Top N by resident memory without sorting the whole table
+        procs["top_by_mem"] = [
+            {k: r[k] for k in ("pid", "ppid", "user", "rss_kb", "cmd")}
+            for r in heapq.nlargest(TOP_N, records, key=lambda r: r["rss_kb"])
+        ]
     except Exception as e:
         procs["error"] = str(e)
     return procs
@@ -1,19 +1,142 @@
+import glob
+import os
 import sys
-import subprocess
+from utils.cache import read_json, write_json
 
+# Distributions are read from *.dist-info / *.egg-info metadata on disk
+# rather than by running pip, which starts an interpreter and imports its
+# vendored stack. Per directory, results are cached until its mtime changes
+# (installing, upgrading or removing a distribution renames entries in it).
+CACHE_FILE = "dists.json"
+SUFFIXES = (".dist-info", ".egg-info")
 
-def collect():
+
+def _read_metadata(path):
+    # Name and Version are among the first headers; stop at the body
+    if os.path.isdir(path):
+        path = os.path.join(
+            path, "METADATA" if path.endswith(".dist-info") else "PKG-INFO"
+        )
+    fields = {}
+    try:
+        with open(path, encoding="utf-8", errors="replace") as f:
+            for line in f:
+                if not line.strip():
+                    break
+                key, sep, value = line.partition(":")
+                if sep and key in ("Name", "Version"):
+                    fields[key] = value.strip()
+                    if len(fields) == 2:
+                        break
+    except OSError:
+        pass
+    return fields
+
+
+def _from_dirname(fname):
+    # "name-1.0.dist-info" or "name-1.0-py3.11.egg-info"
+    stem = fname.rsplit(".", 1)[0]
+    parts = stem.split("-")
+    return {"Name": parts[0], "Version": parts[1]} if len(parts) > 1 else {}
+
+
+def scan_dir(path):
+    dists = {}
+    with os.scandir(path) as it:
+        for entry in it:
+            if entry.name.endswith(SUFFIXES):
+                fields = _read_metadata(entry.path) or {}
+                if "Name" not in fields or "Version" not in fields:
+                    fields = dict(_from_dirname(entry.name), **fields)
+                if "Name" in fields:
+                    dists.setdefault(fields["Name"], fields.get("Version", ""))
+    return dists
+
+
+class DistCache:
+    def __init__(self):
+        self.dirs = read_json("python", CACHE_FILE) or {}
+        self.changed = False
+
+    def packages(self, path):
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return {}
+        cached = self.dirs.get(path)
+        if cached and cached["mtime_ns"] == mtime:
+            return cached["packages"]
+        dists = scan_dir(path)
+        self.dirs[path] = {"mtime_ns": mtime, "packages": dists}
+        self.changed = True
+        return dists
+
+    def save(self):
+        if self.changed:
+            write_json("python", CACHE_FILE, self.dirs)
+
+
+def inventory(dirs, cache):
+    # Earlier directories shadow later ones, as on sys.path
+    packages = {}
+    for path in dirs:
+        for name, version in cache.packages(path).items():
+            packages.setdefault(name, version)
+    return dict(sorted(packages.items(), key=lambda p: p[0].lower()))
+
+
+def env_site_dirs(root):
+    # A site-packages directory itself, or a venv/prefix containing one
+    if glob.glob(os.path.join(root, "*.dist-info")):
+        return [root]
+    patterns = [
+        "lib/python*/site-packages",
+        "lib64/python*/site-packages",
+        "lib/python3/dist-packages",
+        "lib/python*/dist-packages",
+        "Lib/site-packages",
+    ]
+    dirs = []
+    for pattern in patterns:
+        for path in sorted(glob.glob(os.path.join(root, pattern))):
+            if path not in dirs:
+                dirs.append(path)
+    return dirs
+
+
+def _pyvenv_version(root):
+    try:
+        with open(os.path.join(root, "pyvenv.cfg")) as f:
+            for line in f:
+                key, _, value = line.partition("=")
+                if key.strip() in ("version", "version_info"):
+                    return value.strip()
+    except OSError:
+        pass
+    return None
+
+
+def collect(envs=None):
     py = {}
     try:
         py["sys_version"] = sys.version
         py["sys_executable"] = sys.executable
-        # Installed pip packages
-        pip = subprocess.run(
-            [sys.executable, "-m", "pip", "list", "--format", "freeze"],
-            capture_output=True,
-            text=True,
-        )
-        py["pip"] = pip.stdout
+        cache = DistCache()
+        dirs = [p for p in sys.path if p and os.path.isdir(p)]
+        py["packages"] = inventory(dirs, cache)
+        # Other interpreters and venvs, read without running them
+        if envs:
+            py["environments"] = {}
+            for root in envs:
+                site_dirs = env_site_dirs(root)
+                env = {"site_dirs": site_dirs, "packages": inventory(site_dirs, cache)}
+                version = _pyvenv_version(root)
+                if version:
+                    env["version"] = version
+                if not site_dirs:
+                    env["error"] = "no site-packages found"
+                py["environments"][root] = env
+        cache.save()
         # Virtualenv/conda?
         py["VIRTUAL_ENV"] = sys.prefix
     except Exception as e:
@@ -1,24 +1,140 @@
-import subprocess
+import os
+import re
 import shutil
+from utils.shell import run
 
+# All unit properties come from one `systemctl show` over the whole unit
+# list instead of a fork per unit. Only these properties are requested
+# unless the caller passes its own allow-list ("all" for every property).
+PROPERTIES = [
+    "Id",
+    "Description",
+    "LoadState",
+    "ActiveState",
+    "SubState",
+    "UnitFileState",
+    "Result",
+    "MainPID",
+    "NRestarts",
+    "ActiveEnterTimestamp",
+    "MemoryCurrent",
+    "CPUUsageNSec",
+    "TasksCurrent",
+    "FragmentPath",
+]
+INTEGER_PROPERTIES = {
+    "MainPID",
+    "ExecMainPID",
+    "ExecMainStatus",
+    "NRestarts",
+    "MemoryCurrent",
+    "CPUUsageNSec",
+    "TasksCurrent",
+}
+# Values that mean "not available", e.g. MemoryCurrent without accounting
+UNSET = {"", "[not set]", "18446744073709551615"}
+# Units per `systemctl show`, to stay well below the argument size limit
+BATCH_SIZE = 500
+# Present when systemd is the init system (see sd_booted(3))
+SYSTEMD_RUNTIME = "/run/systemd/system"
+_STATUS = re.compile(r"^\s*\[\s*([+?-])\s*\]\s+(\S+)")
+_STATES = {"+": "active", "-": "inactive", "?": "unknown"}
 
-def collect():
+
+def parse_show(text):
+    # Blocks of Key=Value lines, one per unit, separated by blank lines
+    units = []
+    record = {}
+    for line in text.splitlines() + [""]:
+        if not line.strip():
+            if record:
+                units.append(record)
+                record = {}
+            continue
+        key, _, value = line.partition("=")
+        if value in UNSET:
+            continue
+        if key in INTEGER_PROPERTIES and value.isdigit():
+            value = int(value)
+        record[key] = value
+    return units
+
+
+def systemd_units(properties=None):
+    listed = run(
+        [
+            "systemctl",
+            "list-units",
+            "--type=service",
+            "--all",
+            "--plain",
+            "--no-legend",
+            "--no-pager",
+        ]
+    )
+    if listed.returncode != 0:
+        raise RuntimeError(listed.stderr.strip() or "systemctl list-units failed")
+    # "name.service loaded active running Description", possibly prefixed
+    # with a status marker. Units that are only referenced by others but not
+    # installed are skipped.
+    names = []
+    for line in listed.stdout.splitlines():
+        fields = line.split()
+        if fields and not fields[0].endswith(".service"):
+            fields = fields[1:]
+        if len(fields) >= 2 and fields[1] != "not-found":
+            names.append(fields[0])
+    if properties == ["all"]:
+        args = []
+    else:
+        wanted = list(properties or PROPERTIES)
+        # Records are identified by Id
+        if "Id" not in wanted:
+            wanted.insert(0, "Id")
+        args = ["--property=" + ",".join(wanted)]
+    units = []
+    for i in range(0, len(names), BATCH_SIZE):
+        shown = run(
+            ["systemctl", "show", "--no-pager"] + args + names[i : i + BATCH_SIZE]
+        )
+        if shown.returncode != 0:
+            raise RuntimeError(shown.stderr.strip() or "systemctl show failed")
+        units.extend(parse_show(shown.stdout))
+    return units
+
+
+def sysv_services():
+    # service --status-all: " [ + ]  ssh"
+    units = []
+    output = run(["service", "--status-all"])
+    for line in (output.stdout + output.stderr).splitlines():
+        match = _STATUS.match(line)
+        if match:
+            units.append({"Id": match.group(2), "ActiveState": _STATES[match.group(1)]})
+    # Services of unknown state are reported on stderr
+    return sorted(units, key=lambda u: u["Id"])
+
+
+def collect(properties=None):
     svcs = {}
     try:
-        if shutil.which("systemctl"):
-            list_units = subprocess.run(
-                ["systemctl", "list-units", "--type=service", "--state=running,failed"],
-                capture_output=True,
-                text=True,
-            )
-            svcs["systemctl"] = list_units.stdout
+        if os.path.isdir(SYSTEMD_RUNTIME) and shutil.which("systemctl"):
+            svcs["manager"] = "systemd"
+            units = systemd_units(properties)
         elif shutil.which("service"):
-            service_list = subprocess.run(
-                ["service", "--status-all"], capture_output=True, text=True
-            )
-            svcs["service"] = service_list.stdout
+            svcs["manager"] = "sysvinit"
+            units = sysv_services()
         else:
             svcs["error"] = "No known service manager found"
+            return svcs
+        states = {}
+        for unit in units:
+            state = unit.get("ActiveState", "unknown")
+            states[state] = states.get(state, 0) + 1
+        svcs["count"] = len(units)
+        svcs["states"] = states
+        svcs["failed"] = [u["Id"] for u in units if u.get("ActiveState") == "failed"]
+        svcs["units"] = units
     except Exception as e:
         svcs["error"] = str(e)
     return svcs
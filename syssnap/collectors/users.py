@@ -1,16 +1,16 @@
+from utils.shell import read_file
+
+
 def collect():
     users = {}
     try:
         # List all users
-        with open("/etc/passwd") as f:
-            users["passwd"] = f.read()
+        users["passwd"] = read_file("/etc/passwd")
         # List all groups
-        with open("/etc/group") as f:
-            users["group"] = f.read()
+        users["group"] = read_file("/etc/group")
         # Sudoers
         try:
-            with open("/etc/sudoers") as f:
-                users["sudoers"] = f.read()
+            users["sudoers"] = read_file("/etc/sudoers")
         except Exception:
             users["sudoers"] = "N/A"
     except Exception as e:
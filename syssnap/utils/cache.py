@@ -0,0 +1,162 @@
+import hashlib
+import json
+import os
+import time
+from utils.paths import cache_dir
+
+# Collectors whose output rarely changes declare when a cached result goes
+# stale with a module-level CACHE dict:
+#
+#   "ttl":      maximum age in seconds
+#   "boot":     True to invalidate on reboot (kernel boot_id)
+#   "paths":    files or directories whose mtime, size and inode are checked;
+#               may be a function returning the list
+#   "contents": small files (e.g. in /proc) whose content is hashed, for
+#               files whose mtime means nothing
+#
+# The collector's own source file is always part of the signature.
+CACHE_VERSION = 1
+BOOT_ID = "/proc/sys/kernel/random/boot_id"
+
+# How every on-disk cache of this run is used: "on", "refresh" (write but
+# never read, for --refresh-cache) or "off" (neither, for --no-cache)
+_mode = "on"
+
+
+def set_cache_mode(mode):
+    global _mode
+    _mode = mode
+
+
+def _write_private(path, data):
+    # Atomic, and readable by the user only: caches hold unredacted data
+    try:
+        fd = os.open(path + ".tmp", os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f)
+        os.replace(path + ".tmp", path)
+    except (OSError, TypeError, ValueError):
+        pass
+
+
+def read_json(subdir, fname):
+    # Helper state that collectors keep across runs (name lookups, scan
+    # results); None when missing, unreadable or not to be read in this run
+    if _mode != "on":
+        return None
+    try:
+        with open(os.path.join(cache_dir(subdir), fname)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_json(subdir, fname, data):
+    if _mode != "off":
+        _write_private(os.path.join(cache_dir(subdir), fname), data)
+
+
+def _read(path):
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def _stat(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_mtime_ns, st.st_size, st.st_ino]
+
+
+def signature(module, policy):
+    sig = {"source": _stat(getattr(module, "__file__", "") or "")}
+    if policy.get("boot"):
+        boot_id = _read(BOOT_ID)
+        sig["boot"] = boot_id.decode().strip() if boot_id else None
+    paths = policy.get("paths", [])
+    if callable(paths):
+        paths = paths()
+    if paths:
+        sig["paths"] = {path: _stat(path) for path in paths}
+    if policy.get("contents"):
+        sig["contents"] = {}
+        for path in policy["contents"]:
+            data = _read(path)
+            sig["contents"][path] = hashlib.sha1(data).hexdigest() if data else None
+    return sig
+
+
+class ResultCache:
+    # Collector results on disk, one JSON file per collector and options.
+    # ``read`` is false for --refresh-cache: results are recomputed and
+    # stored, but never served.
+    def __init__(self, path=None, read=True):
+        self.path = path or cache_dir("results")
+        self.read = read
+
+    def _entry_path(self, name, options):
+        key = json.dumps([name, options, os.geteuid()], sort_keys=True, default=str)
+        digest = hashlib.sha1(key.encode()).hexdigest()[:16]
+        return os.path.join(self.path, f"{name}-{digest}.json")
+
+    def load(self, name, options, sig, ttl):
+        try:
+            with open(self._entry_path(name, options)) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        age = time.time() - entry.get("created", 0)
+        if entry.get("version") != CACHE_VERSION or entry.get("signature") != sig:
+            return None
+        if age < 0 or (ttl is not None and age > ttl):
+            return None
+        return entry["data"], age
+
+    def store(self, name, options, sig, data):
+        path = self._entry_path(name, options)
+        entry = {
+            "version": CACHE_VERSION,
+            "created": time.time(),
+            "signature": sig,
+            "data": data,
+        }
+        _write_private(path, entry)
+
+
+class CachedCollector:
+    # Wraps a collector module that declares CACHE. A section served from
+    # the cache carries "_cache": {"age": seconds, "created": timestamp}.
+    def __init__(self, name, module, store):
+        self.name = name
+        self.module = module
+        self.store = store
+        self.policy = module.CACHE
+        self.cost = getattr(module, "cost", None)
+
+    def collect(self, **options):
+        sig = signature(self.module, self.policy)
+        if self.store.read:
+            cached = self.store.load(self.name, options, sig, self.policy.get("ttl"))
+            if cached is not None:
+                data, age = cached
+                if isinstance(data, dict):
+                    data["_cache"] = {
+                        "age": round(age, 1),
+                        "created": round(time.time() - age, 3),
+                    }
+                return data
+        data = self.module.collect(**options)
+        # Failed collections are not cached
+        if not (isinstance(data, dict) and "error" in data):
+            self.store.store(self.name, options, sig, data)
+        return data
+
+
+def cached(name, module, store):
+    if store is None or not isinstance(getattr(module, "CACHE", None), dict):
+        return module
+    return CachedCollector(name, module, store)
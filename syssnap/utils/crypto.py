@@ -1,27 +1,307 @@
 import zipfile
 import io
-from cryptography.fernet import Fernet, InvalidToken
+import lzma
+import os
+import struct
+import time
+import zlib
 import getpass
 
+CODECS = {"zip": ".zip", "gzip": ".gz", "xz": ".xz", "zstd": ".zst"}
+
+
+def _compressor(codec, level):
+    if codec == "gzip":
+        return zlib.compressobj(6 if level is None else level, zlib.DEFLATED, 31)
+    if codec == "xz":
+        return lzma.LZMACompressor(preset=6 if level is None else level)
+    if codec == "zstd":
+        try:
+            import zstandard
+        except ImportError:
+            raise RuntimeError("zstd compression requires the 'zstandard' package")
+        compressor = zstandard.ZstdCompressor(level=3 if level is None else level)
+        return compressor.compressobj()
+    raise ValueError(f"Unknown compression codec: {codec}")
+
+
+def check_codec(codec, level=None):
+    # Builds a throwaway compressor, so that a missing optional dependency
+    # (RuntimeError) or an invalid level (ValueError) is reported before any
+    # output file is opened
+    try:
+        if codec == "zip":
+            archive = zipfile.ZipFile(
+                io.BytesIO(), "w", zipfile.ZIP_DEFLATED, compresslevel=level
+            )
+            with archive, archive.open("snapshot", "w"):
+                pass
+        else:
+            _compressor(codec, level)
+    except RuntimeError:
+        raise
+    except Exception:
+        raise ValueError(f"Invalid compression level for {codec}: {level}")
+
+
+class _Counted:
+    def __init__(self, owner):
+        self.owner = owner
+
+    def write(self, data):
+        self.owner._emit(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+
+class CompressedStream:
+    # Write-only stream that compresses whatever the serializer hands it and
+    # passes the compressed bytes on to ``dest`` as it goes, so neither the
+    # snapshot nor its compressed copy has to be held in memory.
+    def __init__(self, dest, codec="zip", level=None):
+        self.dest = dest
+        self.codec = codec
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.seconds = 0.0
+        if codec == "zip":
+            self._zip = zipfile.ZipFile(
+                _Counted(self), "w", zipfile.ZIP_DEFLATED, compresslevel=level
+            )
+            self._member = self._zip.open("snapshot", "w", force_zip64=True)
+        else:
+            self._compressor = _compressor(codec, level)
+
+    def write(self, data):
+        started = time.perf_counter()
+        self.bytes_in += len(data)
+        if self.codec == "zip":
+            self._member.write(data)
+        else:
+            self._emit(self._compressor.compress(data))
+        self.seconds += time.perf_counter() - started
+
+    def flush(self):
+        # Only the destination is flushed; flushing the compressor after
+        # every section would cost compression ratio
+        self.dest.flush()
+
+    def close(self):
+        started = time.perf_counter()
+        if self.codec == "zip":
+            self._member.close()
+            self._zip.close()
+        else:
+            self._emit(self._compressor.flush())
+        self.seconds += time.perf_counter() - started
+        self.dest.flush()
+
+    def _emit(self, data):
+        if data:
+            self.dest.write(data)
+            self.bytes_out += len(data)
+
+    def stats(self):
+        ratio = self.bytes_in / self.bytes_out if self.bytes_out else 0
+        rate = self.bytes_in / 1e6 / self.seconds if self.seconds else 0
+        return {
+            "codec": self.codec,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "ratio": round(ratio, 2),
+            "mb_per_sec": round(rate, 1),
+        }
+
+
+# Encrypted container: a header carrying the scrypt parameters, salt and
+# nonce prefix, followed by AES-256-GCM frames of at most FRAME_SIZE bytes
+# of plaintext. Each frame is stored as a 4-byte length, whose top bit marks
+# the last frame, and the ciphertext. The nonce is the prefix, the frame
+# counter and the last-frame flag, and the header is authenticated with
+# every frame, so frames cannot be reordered, dropped or cut off unnoticed.
+MAGIC = b"SYSSNAPE"
+VERSION = 1
+DEFAULT_KDF_COST = 15
+# scrypt needs 128 * r * N bytes, and hashlib caps maxmem below 2 GiB, so
+# with r=8 the cost (log2 N) tops out at 19 (512 MiB)
+MIN_KDF_COST = 10
+MAX_KDF_COST = 19
+MAX_FRAME_SIZE = 16 * 1024 * 1024
+FRAME_SIZE = 64 * 1024
+_HEADER = struct.Struct(">BBBB16s7sI")
+_LAST = 0x80000000
+PASSPHRASE_ENV = "SYSSNAP_PASSPHRASE"
+
+
+def read_passphrase(confirm=False):
+    passphrase = os.environ.get(PASSPHRASE_ENV)
+    if passphrase:
+        return passphrase
+    passphrase = getpass.getpass("Enter passphrase: ")
+    if confirm and getpass.getpass("Confirm passphrase: ") != passphrase:
+        raise ValueError("Passphrases do not match")
+    if not passphrase:
+        raise ValueError("Empty passphrase")
+    return passphrase
+
+
+def _derive_key(passphrase, salt, log_n, r, p):
+    import hashlib
+
+    n = 1 << log_n
+    return hashlib.scrypt(
+        passphrase.encode("utf-8"),
+        salt=salt,
+        n=n,
+        r=r,
+        p=p,
+        maxmem=256 * r * (n + p) + (1 << 20),
+        dklen=32,
+    )
+
+
+def _aead(key):
+    # cryptography is only loaded when encrypting or decrypting
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+    return AESGCM(key)
+
+
+def _nonce(prefix, counter, last):
+    return prefix + struct.pack(">IB", counter, 1 if last else 0)
+
+
+class EncryptedStream:
+    # Write-only stream that encrypts its input in FRAME_SIZE frames and
+    # passes them on to ``dest``; at most one frame of plaintext is buffered
+    def __init__(
+        self, dest, passphrase, cost=DEFAULT_KDF_COST, frame_size=FRAME_SIZE
+    ):
+        if not MIN_KDF_COST <= cost <= MAX_KDF_COST:
+            raise ValueError(
+                f"KDF cost must be between {MIN_KDF_COST} and {MAX_KDF_COST}"
+            )
+        self.dest = dest
+        self.frame_size = frame_size
+        salt = os.urandom(16)
+        self._prefix = os.urandom(7)
+        self._header = MAGIC + _HEADER.pack(
+            VERSION, cost, 8, 1, salt, self._prefix, frame_size
+        )
+        self._aead = _aead(_derive_key(passphrase, salt, cost, 8, 1))
+        self._counter = 0
+        self._buffer = bytearray()
+        self.dest.write(self._header)
+
+    def write(self, data):
+        self._buffer += data
+        # Keep the remainder buffered so the last frame is never empty
+        while len(self._buffer) > self.frame_size:
+            self._frame(bytes(self._buffer[: self.frame_size]), False)
+            del self._buffer[: self.frame_size]
+
+    def flush(self):
+        self.dest.flush()
+
+    def close(self):
+        self._frame(bytes(self._buffer), True)
+        self._buffer = bytearray()
+        self.dest.flush()
+
+    def _frame(self, plaintext, last):
+        if self._counter >= 1 << 32:
+            raise ValueError("Snapshot too large to encrypt")
+        nonce = _nonce(self._prefix, self._counter, last)
+        ciphertext = self._aead.encrypt(nonce, plaintext, self._header)
+        self.dest.write(struct.pack(">I", len(ciphertext) | (_LAST if last else 0)))
+        self.dest.write(ciphertext)
+        self._counter += 1
+
+
+def _read_exact(stream, size):
+    data = stream.read(size)
+    if len(data) != size:
+        raise ValueError("Encrypted snapshot is truncated")
+    return data
+
+
+def is_encrypted(head):
+    return head.startswith(MAGIC)
+
+
+def iter_decrypt(stream, passphrase):
+    # Yields the plaintext frame by frame
+    if not is_encrypted(_read_exact(stream, len(MAGIC))):
+        raise ValueError("Not an encrypted snapshot")
+    header = _read_exact(stream, _HEADER.size)
+    version, log_n, r, p, salt, prefix, frame_size = _HEADER.unpack(header)
+    if version != VERSION:
+        raise ValueError(f"Unsupported encrypted snapshot version: {version}")
+    # The header is only authenticated with the first frame, after the key
+    # has been derived from it, so bound what it can make the KDF do
+    if not (
+        MIN_KDF_COST <= log_n <= MAX_KDF_COST
+        and 1 <= r <= 8
+        and 1 <= p <= 4
+        and 1 <= frame_size <= MAX_FRAME_SIZE
+    ):
+        raise ValueError("Encrypted snapshot header is corrupted")
+    from cryptography.exceptions import InvalidTag
+
+    aad = MAGIC + header
+    aead = _aead(_derive_key(passphrase, salt, log_n, r, p))
+    counter = 0
+    while True:
+        (length,) = struct.unpack(">I", _read_exact(stream, 4))
+        last = bool(length & _LAST)
+        length &= ~_LAST
+        if length > frame_size + 16:
+            raise ValueError("Encrypted snapshot is corrupted")
+        ciphertext = _read_exact(stream, length)
+        try:
+            yield aead.decrypt(_nonce(prefix, counter, last), ciphertext, aad)
+        except InvalidTag:
+            raise ValueError("Wrong passphrase or corrupted snapshot")
+        counter += 1
+        if last:
+            break
+    if stream.read(1):
+        raise ValueError("Unexpected data after the end of the encrypted snapshot")
+
+
+def decrypt_file(path, dest, passphrase):
+    with open(path, "rb") as f:
+        for chunk in iter_decrypt(f, passphrase):
+            dest.write(chunk)
+    dest.flush()
+
+
+# Magic numbers of the formats written by CompressedStream
+_COMPRESSED = (
+    (b"\x1f\x8b", "gzip"),
+    (b"\xfd7zXZ\x00", "xz"),
+    (b"(\xb5/\xfd", "zstd"),
+    (b"PK\x03\x04", "zip"),
+)
+
+
+def decompress(data):
+    # Returns ``data`` unchanged when it is not in a known compressed format
+    for magic, codec in _COMPRESSED:
+        if data.startswith(magic):
+            break
+    else:
+        return data
+    if codec == "gzip":
+        return zlib.decompress(data, 47)
+    if codec == "xz":
+        return lzma.decompress(data)
+    if codec == "zip":
+        with zipfile.ZipFile(io.BytesIO(data)) as archive:
+            return archive.read(archive.namelist()[0])
+    import zstandard
+
+    return zstandard.ZstdDecompressor().stream_reader(io.BytesIO(data)).read()
 
-def compress_snapshot(bytes_data, out_path):
-    zip_buffer = io.BytesIO()
-    with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED) as zf:
-        zf.writestr("snapshot", bytes_data)
-    compressed = zip_buffer.getvalue()
-    if out_path:
-        with open(out_path + ".zip", "wb") as f:
-            f.write(compressed)
-    return compressed
-
-
-def encrypt_snapshot(bytes_data, out_path):
-    passphrase = getpass.getpass("Enter passphrase for encryption: ")
-    key = Fernet.generate_key()
-    cipher_suite = Fernet(key)
-    encrypted = cipher_suite.encrypt(bytes_data)
-    if out_path:
-        with open(out_path + ".enc", "wb") as f:
-            f.write(encrypted)
-    print("Encryption key (save it securely!):", key.decode())
-    return encrypted
@@ -1,19 +1,324 @@
+import io
 import json
+import re
 import yaml
-import difflib
+from utils.crypto import (
+    CODECS,
+    decompress,
+    is_encrypted,
+    iter_decrypt,
+    read_passphrase,
+)
 
+_IDENTIFIER = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+_COMPRESSED_EXTS = tuple(CODECS.values())
 
-def diff_snapshots(file1, file2, fmt="json"):
-    with open(file1) as f1, open(file2) as f2:
-        if file1.endswith(".yaml") or file1.endswith(".yml"):
-            d1 = yaml.safe_load(f1)
+
+def load_snapshot(path):
+    with open(path, "rb") as f:
+        data = f.read()
+    name = path
+    if is_encrypted(data):
+        data = b"".join(iter_decrypt(io.BytesIO(data), read_passphrase()))
+        name = name[: -len(".enc")] if name.endswith(".enc") else name
+    data = decompress(data)
+    name = name.rsplit(".", 1)[0] if name.endswith(_COMPRESSED_EXTS) else name
+    if name.endswith(".yaml") or name.endswith(".yml"):
+        return yaml.safe_load(data)
+    text = data.decode("utf-8")
+    try:
+        snapshot = json.loads(text)
+    except json.JSONDecodeError:
+        return _load_ndjson(text, path)
+    # A one-section ndjson file is a single valid JSON record
+    if isinstance(snapshot, dict) and snapshot.keys() == {"section", "data"}:
+        return _load_ndjson(text, path)
+    return snapshot
+
+
+def _load_ndjson(text, path):
+    # One {"section": ..., "data": ...} record per line
+    snapshot = {}
+    for number, line in enumerate(text.splitlines(), 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"{path}:{number}: {e}") from None
+        if not isinstance(record, dict) or "section" not in record:
+            raise ValueError(f"{path}:{number}: record without a section")
+        snapshot[record["section"]] = record.get("data")
+    return snapshot
+
+
+def _digest(node, digests):
+    # Structural hash of a subtree, memoized per container so that subtrees
+    # which differ are told apart without comparing them. Dict digests do
+    # not depend on key order. Equal digests are only a hint (hash(-1) ==
+    # hash(-2)), so structural_diff confirms them with ==.
+    if isinstance(node, dict):
+        h = hash(frozenset((k, _digest(v, digests)) for k, v in node.items()))
+    elif isinstance(node, list):
+        h = hash(tuple(_digest(v, digests) for v in node))
+    else:
+        return hash((type(node).__name__, node))
+    digests[id(node)] = h
+    return h
+
+
+# Bookkeeping that is not part of the system's state
+IGNORED_KEYS = {"_cache"}
+
+
+def _key_path(path, key):
+    if isinstance(key, int):
+        return f"{path}[{key}]"
+    if _IDENTIFIER.match(key):
+        return f"{path}.{key}" if path else key
+    return f"{path}[{json.dumps(key)}]"
+
+
+def _member_path(path, key, field=None):
+    if field:
+        return f"{path}[{field}={json.dumps(key)}]"
+    return f"{path}[{json.dumps(key)}]"
+
+
+# Line-oriented listings where order carries no meaning. Each parser turns
+# the text into {key: value}; identical keys are counted so that duplicate
+# lines (e.g. the same rule twice in a chain) are not lost.
+def _parse_dpkg(text):
+    entries = {}
+    for line in text.splitlines():
+        parts = line.split(None, 4)
+        if len(parts) >= 4 and len(parts[0]) in (2, 3) and parts[0][0] in "uirph":
+            status = "" if parts[0] == "ii" else f" ({parts[0]})"
+            entries[f"{parts[1]}:{parts[3]}"] = parts[2] + status
+    return entries
+
+
+def _parse_rpm(text):
+    entries = {}
+    for line in text.splitlines():
+        # name-version-release.arch; names may themselves contain dashes
+        parts = line.strip().rsplit("-", 2)
+        if len(parts) == 3:
+            entries[parts[0]] = f"{parts[1]}-{parts[2]}"
+        elif line.strip():
+            entries[line.strip()] = ""
+    return entries
+
+
+def _parse_pairs(separator):
+    def parse(text):
+        entries = {}
+        for line in text.splitlines():
+            name, sep, value = line.strip().partition(separator)
+            if name and sep:
+                entries[name.strip()] = value.strip()
+        return entries
+
+    return parse
+
+
+def _parse_lsmod(text):
+    entries = {}
+    for line in text.splitlines()[1:]:
+        parts = line.split()
+        if len(parts) >= 2:
+            entries[parts[0]] = int(parts[1]) if parts[1].isdigit() else parts[1]
+    return entries
+
+
+def _parse_ps_aux(text):
+    entries = {}
+    for line in text.splitlines()[1:]:
+        parts = line.split(None, 10)
+        if len(parts) == 11:
+            entries[parts[1]] = f"{parts[0]} {parts[10]}"
+    return entries
+
+
+_COUNTERS = re.compile(r"\d+[KMGT]? packets, \d+[KMGT]? bytes")
+
+
+def _parse_rules(text):
+    # iptables -L -v: drop the packet/byte counters, which change on every
+    # run, and key each rule by the chain it belongs to
+    entries = {}
+    chain = ""
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith("pkts "):
+            continue
+        if line.startswith("Chain "):
+            name, _, policy = line.partition(" (")
+            chain = name[6:]
+            entries[name] = _COUNTERS.sub("", policy).rstrip(")").strip(" ,")
+            continue
+        parts = line.split(None, 2)
+        if len(parts) == 3 and parts[0][:1].isdigit() and parts[1][:1].isdigit():
+            line = parts[2]
+        key = f"{chain}: {' '.join(line.split())}"
+        entries[key] = entries.get(key, 0) + 1
+    return entries
+
+
+LISTING_FIELDS = {
+    "packages.dpkg": _parse_dpkg,
+    "packages.rpm": _parse_rpm,
+    "packages.pacman": _parse_pairs(" "),
+    "python.pip": _parse_pairs("=="),
+    "processes.ps_aux": _parse_ps_aux,
+    "kernelmods.lsmod": _parse_lsmod,
+    "firewall.iptables_list": _parse_rules,
+    "firewall.iptables_nat": _parse_rules,
+    "firewall.iptables_mangle": _parse_rules,
+    "firewall.iptables_raw": _parse_rules,
+    "firewall.ip6tables_list": _parse_rules,
+}
+
+# Lists of records identified by one of their fields
+KEYED_LISTS = {
+    "processes.processes": "pid",
+    "kernelmods.modules_structured": "name",
+    "kernelmods.builtin_modules": "name",
+    "packages.packages": ("name", "arch"),
+    "hardware.pci": "slot",
+    "hardware.usb": "path",
+    "hardware.block": "name",
+    "hardware.net": "name",
+    "docker.containers": "Id",
+    "docker.images": "Id",
+    "docker.volumes": "Name",
+    "docker.networks": "Id",
+    "services.units": "Id",
+}
+
+
+def _keyed(records, fields):
+    # ``fields`` is one field or a tuple of fields joined with ":". A key
+    # seen twice (e.g. several installed kernels) is told apart by version.
+    if isinstance(fields, str):
+        fields = (fields,)
+    keyed = {}
+    for record in records:
+        if not isinstance(record, dict) or any(f not in record for f in fields):
+            continue
+        if len(fields) == 1:
+            key = record[fields[0]]
         else:
-            d1 = json.load(f1)
-        if file2.endswith(".yaml") or file2.endswith(".yml"):
-            d2 = yaml.safe_load(f2)
+            key = ":".join(str(record[f]) for f in fields)
+        if key in keyed:
+            key = f"{key}:{record.get('version', len(keyed))}"
+        keyed[key] = record
+    return keyed
+
+
+def structural_diff(old, new):
+    old_digests, new_digests = {}, {}
+    _digest(old, old_digests)
+    _digest(new, new_digests)
+    changes = []
+
+    def same(a, b):
+        if type(a) is not type(b):
+            return False
+        if isinstance(a, (dict, list)):
+            # Each skipped subtree is compared once; subtrees that differ
+            # are descended into without it
+            return old_digests[id(a)] == new_digests[id(b)] and a == b
+        return a == b
+
+    def walk_members(path, a, b, field=None):
+        # Set semantics: compare by key in linear time, ignoring order
+        for key, value in a.items():
+            member = _member_path(path, key, field)
+            if key not in b:
+                changes.append({"op": "removed", "path": member, "old": value})
+            elif isinstance(value, dict):
+                walk(member, value, b[key])
+            elif value != b[key]:
+                changes.append(
+                    {"op": "changed", "path": member, "old": value, "new": b[key]}
+                )
+        for key, value in b.items():
+            if key not in a:
+                member = _member_path(path, key, field)
+                changes.append({"op": "added", "path": member, "new": value})
+
+    def walk(path, a, b):
+        if same(a, b):
+            return
+        if isinstance(a, str) and isinstance(b, str) and path in LISTING_FIELDS:
+            parse = LISTING_FIELDS[path]
+            walk_members(path, parse(a), parse(b))
+        elif isinstance(a, list) and isinstance(b, list) and path in KEYED_LISTS:
+            fields = KEYED_LISTS[path]
+            label = fields if isinstance(fields, str) else ":".join(fields)
+            walk_members(path, _keyed(a, fields), _keyed(b, fields), label)
+        elif isinstance(a, dict) and isinstance(b, dict):
+            for key, value in a.items():
+                if key in IGNORED_KEYS:
+                    continue
+                if key not in b:
+                    changes.append(
+                        {"op": "removed", "path": _key_path(path, key), "old": value}
+                    )
+                else:
+                    walk(_key_path(path, key), value, b[key])
+            for key, value in b.items():
+                if key not in a and key not in IGNORED_KEYS:
+                    changes.append(
+                        {"op": "added", "path": _key_path(path, key), "new": value}
+                    )
+        elif isinstance(a, list) and isinstance(b, list):
+            for i in range(min(len(a), len(b))):
+                walk(_key_path(path, i), a[i], b[i])
+            for i in range(len(b), len(a)):
+                changes.append(
+                    {"op": "removed", "path": _key_path(path, i), "old": a[i]}
+                )
+            for i in range(len(a), len(b)):
+                changes.append(
+                    {"op": "added", "path": _key_path(path, i), "new": b[i]}
+                )
         else:
-            d2 = json.load(f2)
-    d1s = json.dumps(d1, indent=2).splitlines()
-    d2s = json.dumps(d2, indent=2).splitlines()
-    diff = list(difflib.unified_diff(d1s, d2s, fromfile=file1, tofile=file2))
-    return "\n".join(diff)
+            changes.append({"op": "changed", "path": path, "old": a, "new": b})
+
+    walk("", old, new)
+    return changes
+
+
+def _short(value, limit=80):
+    text = json.dumps(value)
+    return text if len(text) <= limit else text[: limit - 3] + "..."
+
+
+def format_changes(changes, file1, file2):
+    lines = [f"--- {file1}", f"+++ {file2}"]
+    for change in changes:
+        if change["op"] == "added":
+            lines.append(f"+ {change['path']}: {_short(change['new'])}")
+        elif change["op"] == "removed":
+            lines.append(f"- {change['path']}: {_short(change['old'])}")
+        else:
+            old, new = _short(change["old"]), _short(change["new"])
+            lines.append(f"~ {change['path']}: {old} -> {new}")
+    return "\n".join(lines)
+
+
+def diff_snapshots(file1, file2, fmt="json"):
+    changes = structural_diff(load_snapshot(file1), load_snapshot(file2))
+    if fmt == "txt":
+        return format_changes(changes, file1, file2)
+    if fmt == "ndjson":
+        return "\n".join(json.dumps(change) for change in changes)
+    summary = {"added": 0, "removed": 0, "changed": 0}
+    for change in changes:
+        summary[change["op"]] += 1
+    result = {"from": file1, "to": file2, "summary": summary, "changes": changes}
+    if fmt == "yaml":
+        return yaml.dump(result, sort_keys=False)
+    return json.dumps(result, indent=2)
@@ -1,20 +1,53 @@
 import json
-import yaml
-
-
-def write_output(data, fmt="json", out=None, as_bytes=False):
-    if fmt == "json":
-        s = json.dumps(data, indent=2)
-        b = s.encode("utf-8")
-    elif fmt == "yaml":
-        s = yaml.dump(data)
-        b = s.encode("utf-8")
-    else:
-        s = str(data)
-        b = s.encode("utf-8")
-    if out:
-        with open(out, "wb") as f:
-            f.write(b)
-    else:
-        print(s)
-    return b if as_bytes else s
+
+
+class Tee:
+    def __init__(self, *streams):
+        self.streams = streams
+
+    def write(self, data):
+        for stream in self.streams:
+            stream.write(data)
+
+    def flush(self):
+        for stream in self.streams:
+            stream.flush()
+
+
+class SnapshotWriter:
+    # Serializes a snapshot one section at a time, so each collector's data
+    # is emitted as soon as it is available instead of after the slowest one.
+    # json produces the same document as json.dumps(snapshot, indent=2);
+    # ndjson emits one {"section": ..., "data": ...} record per line.
+    def __init__(self, stream, fmt="json"):
+        self.stream = stream
+        self.fmt = fmt
+        self.count = 0
+        self._buffered = {}
+
+    def write_section(self, name, data):
+        if self.fmt == "json":
+            prefix = "{\n  " if self.count == 0 else ",\n  "
+            body = json.dumps(data, indent=2).replace("\n", "\n  ")
+            self._write(prefix + json.dumps(name) + ": " + body)
+        elif self.fmt == "ndjson":
+            self._write(json.dumps({"section": name, "data": data}) + "\n")
+        elif self.fmt == "yaml":
+            import yaml
+
+            self._write(yaml.dump({name: data}))
+        else:
+            # Plain text is a repr of the whole dict and cannot be streamed
+            self._buffered[name] = data
+        self.count += 1
+
+    def close(self):
+        if self.fmt == "json":
+            self._write("\n}\n" if self.count else "{}\n")
+        elif self.fmt not in ("ndjson", "yaml"):
+            self._write(str(self._buffered) + "\n")
+
+    def _write(self, text):
+        self.stream.write(text.encode("utf-8"))
+        self.stream.flush()
+
@@ -0,0 +1,13 @@
+import os
+
+
+def cache_dir(*parts):
+    # Per-user cache directory ($XDG_CACHE_HOME/syssnap, else
+    # ~/.cache/syssnap), created on first use and private to the user since
+    # it holds unredacted collector output
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    path = os.path.join(base, "syssnap", *parts)
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    return path
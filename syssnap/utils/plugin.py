@@ -1,19 +1,162 @@
-import os
+import ast
+import hashlib
 import importlib.util
+import os
+from utils.cache import read_json, write_json
+
+# A plugin may declare itself with a literal dict at module level, which is
+# read without running the module:
+#
+#   PLUGIN = {"name": "nginx", "cost": "expensive", "requires": ["psutil"]}
+#
+# Without one, a module that defines collect() is a plugin named after its
+# file, as before.
+COSTS = ("cheap", "normal", "expensive")
+CACHE_VERSION = 2
+
+
+def _binds_collect(body):
+    # Whether a statement list binds the name collect, looking into the
+    # blocks of conditional definitions (if/try/with)
+    for node in body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            if node.name == "collect":
+                return True
+        elif isinstance(node, (ast.Import, ast.ImportFrom)):
+            if "collect" in [alias.asname or alias.name for alias in node.names]:
+                return True
+        elif isinstance(node, ast.Assign):
+            if any(isinstance(t, ast.Name) and t.id == "collect" for t in node.targets):
+                return True
+        elif isinstance(node, (ast.If, ast.Try, ast.With, ast.AsyncWith)):
+            blocks = [node.body, getattr(node, "orelse", [])]
+            blocks.append(getattr(node, "finalbody", []))
+            blocks.extend(h.body for h in getattr(node, "handlers", []))
+            if any(_binds_collect(block) for block in blocks):
+                return True
+    return False
+
+
+def read_manifest(source, fname):
+    manifest = {"name": fname[:-3], "cost": "normal", "requires": []}
+    try:
+        tree = ast.parse(source, fname)
+    except (SyntaxError, ValueError) as e:
+        manifest["error"] = f"cannot parse plugin: {e}"
+        return manifest
+    declared = None
+    for node in tree.body:
+        if isinstance(node, ast.Assign):
+            targets = [t.id for t in node.targets if isinstance(t, ast.Name)]
+            if "PLUGIN" in targets:
+                try:
+                    declared = ast.literal_eval(node.value)
+                except ValueError:
+                    manifest["error"] = "PLUGIN must be a literal dict"
+    if isinstance(declared, dict):
+        manifest.update(
+            (k, declared[k]) for k in ("name", "cost", "requires") if k in declared
+        )
+    elif not _binds_collect(tree.body):
+        # collect() may still be defined dynamically (star imports,
+        # globals()); whether the file is a plugin is decided on import
+        manifest["probe"] = True
+    if manifest["cost"] not in COSTS:
+        manifest["cost"] = "normal"
+    return manifest
+
+
+def _cache_name(plugin_dir):
+    digest = hashlib.sha1(os.path.abspath(plugin_dir).encode()).hexdigest()[:16]
+    return digest + ".json"
+
+
+def _load_cache(name):
+    cache = read_json("plugins", name) or {}
+    return cache.get("files", {}) if cache.get("version") == CACHE_VERSION else {}
+
+
+def _save_cache(name, files):
+    write_json("plugins", name, {"version": CACHE_VERSION, "files": files})
+
+
+def discover_plugins(plugin_dir):
+    # Returns {filename: manifest}. Manifests are cached per directory and
+    # re-read only for files whose mtime or size changed, and re-parsed only
+    # if their content hash changed too.
+    if not os.path.isdir(plugin_dir):
+        return {}
+    cache_name = _cache_name(plugin_dir)
+    cached = _load_cache(cache_name)
+    files = {}
+    changed = False
+    for entry in os.scandir(plugin_dir):
+        if not entry.name.endswith(".py") or not entry.is_file():
+            continue
+        st = entry.stat()
+        record = cached.get(entry.name)
+        if record and (record["mtime_ns"], record["size"]) == (
+            st.st_mtime_ns,
+            st.st_size,
+        ):
+            files[entry.name] = record
+            continue
+        with open(entry.path, "rb") as f:
+            source = f.read()
+        digest = hashlib.sha256(source).hexdigest()
+        if not record or record["sha256"] != digest:
+            record = {"sha256": digest, "manifest": read_manifest(source, entry.name)}
+        record.update(mtime_ns=st.st_mtime_ns, size=st.st_size)
+        files[entry.name] = record
+        changed = True
+    if changed or len(files) != len(cached):
+        _save_cache(cache_name, files)
+    return {fname: record["manifest"] for fname, record in files.items()}
+
+
+class LazyPlugin:
+    # Stands in for the plugin module; the file is imported on the first
+    # collect() call, i.e. only when the plugin was selected, and in the
+    # runner's worker thread so its imports overlap with other collectors
+    def __init__(self, path, manifest):
+        self.path = path
+        self.manifest = manifest
+        self.name = manifest["name"]
+        self.cost = manifest["cost"]
+        self._module = None
+
+    def load(self):
+        if self._module is None:
+            if self.manifest.get("error"):
+                raise ImportError(self.manifest["error"])
+            for requirement in self.manifest["requires"]:
+                if importlib.util.find_spec(requirement) is None:
+                    raise ImportError(f"missing dependency: {requirement}")
+            mod_name = os.path.basename(self.path)[:-3]
+            spec = importlib.util.spec_from_file_location(mod_name, self.path)
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+            if not hasattr(module, "collect") and not self.manifest.get("probe"):
+                raise ImportError(f"plugin {self.name} has no collect()")
+            self._module = module
+        return self._module
+
+    def collect(self, **options):
+        # Returns None for a file that turns out not to be a plugin (e.g. a
+        # helper module), which then gets no section
+        try:
+            module = self.load()
+        except Exception as e:
+            return {"error": str(e)}
+        if not hasattr(module, "collect"):
+            return None
+        return module.collect(**options)
 
 
 def load_plugins(plugin_dir):
     plugins = {}
-    if not os.path.exists(plugin_dir):
-        return plugins
-    for fname in os.listdir(plugin_dir):
-        if fname.endswith(".py"):
-            mod_name = fname[:-3]
-            spec = importlib.util.spec_from_file_location(
-                mod_name, os.path.join(plugin_dir, fname)
-            )
-            mod = importlib.util.module_from_spec(spec)
-            spec.loader.exec_module(mod)
-            if hasattr(mod, "collect"):
-                plugins[mod_name] = mod
+    for fname, manifest in sorted(discover_plugins(plugin_dir).items()):
+        plugins[manifest["name"]] = LazyPlugin(
+            os.path.join(plugin_dir, fname), manifest
+        )
     return plugins
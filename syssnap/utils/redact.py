@@ -12,31 +12,206 @@ SENSITIVE_KEYS = [
 ]
 ANONYMIZE_KEYS = ["hostname", "user", "username", "login", "ip", "mac", "host"]
 
+# Same matches as \b(?:\d{1,3}\.){3}\d{1,3}\b and the MAC equivalent, but the
+# word boundary is checked by a lookbehind after the first character, which
+# lets the regex engine skip ahead to candidate characters instead of
+# trying every position
+_IP = re.compile(r"\d(?<!\w\d)\d{0,2}\.(?:\d{1,3}\.){2}\d{1,3}\b")
+_MAC = re.compile(r"[a-fA-F0-9](?<!\w[a-fA-F0-9])[a-fA-F0-9](?::[a-fA-F0-9]{2}){5}\b")
+MAX_MEMO = 65536
+_UNSEEN = object()
+
+
+def _words(words):
+    # Matched against the lowercased key, as the substring checks were
+    return re.compile("|".join(re.escape(w) for w in words))
+
+
+def anonymize_text(text):
+    # An IP needs a "." and a MAC a ":"; most strings have neither
+    if "." in text:
+        text = _IP.sub("[ANONYMIZED_IP]", text)
+    if ":" in text:
+        text = _MAC.sub("[ANONYMIZED_MAC]", text)
+    return text
+
+
+# Secrets inside free text: (name, regex, trigger substrings). Every match
+# starts with one of the pattern's triggers (compared in lowercase), so the
+# triggers are located with str.find and the regex is only tried at those
+# offsets rather than at every position of a large blob. Where a pattern has
+# a "value" group only that part is replaced, so the context (the key name,
+# the URL's host) survives.
+SECRET_PATTERNS = [
+    (
+        "aws_access_key",
+        r"(?<![0-9A-Za-z_])(?:AKIA|ASIA)[0-9A-Z]{16}\b",
+        ["akia", "asia"],
+    ),
+    (
+        "pem_private_key",
+        r"-----BEGIN [A-Z ]*PRIVATE KEY-----.*?(?:-----END [A-Z ]*PRIVATE KEY-----|$)",
+        ["-----begin"],
+    ),
+    (
+        "bearer_token",
+        r"(?i:bearer)\s+(?P<value>[A-Za-z0-9\-._~+/]{8,}=*)",
+        ["bearer"],
+    ),
+    ("url_userinfo", r"://[^\s/:@]*:(?P<value>[^\s/@]+)@", ["://"]),
+    (
+        "password_assignment",
+        r"(?i:pass(?:word|wd|phrase)|secret|token|api_?key|credential)[\w.-]*"
+        r"[\"']?[ \t]*[=:](?![=:])[ \t]*"
+        r"(?P<value>\"[^\"\n]*\"|'[^'\n]*'|[^\s\"',;&]+)",
+        ["pass", "secret", "token", "apikey", "api_key", "credential"],
+    ),
+    (
+        "secret_argument",
+        r"(?<![^\s-])-(?i:pass(?:word|wd|phrase)?|secret|token|api[_-]?key)"
+        r"[ \t]+(?P<value>[^\s-]\S*)",
+        ["-pass", "-secret", "-token", "-api"],
+    ),
+]
+REDACTED = "[REDACTED]"
+# Short values (states, user names, paths) repeat across records, so their
+# results are memoized
+MEMO_LENGTH = 256
+
+
+class SecretScanner:
+    def __init__(self, patterns=SECRET_PATTERNS):
+        self.hits = {name: 0 for name, _, _ in patterns}
+        self._rules = [
+            (name, re.compile(pattern, re.S), triggers)
+            for name, pattern, triggers in patterns
+        ]
+        self._memo = {}
+
+    def _candidates(self, text, lowered):
+        for name, regex, triggers in self._rules:
+            for trigger in triggers:
+                start = lowered.find(trigger)
+                while start >= 0:
+                    match = regex.match(text, start)
+                    if match:
+                        yield match.start(), name, match
+                    start = lowered.find(trigger, start + 1)
+
+    def _fallback(self, text, lowered):
+        # Lowercasing changed the length (some non-ASCII characters do), so
+        # offsets in ``lowered`` do not apply to ``text``
+        for name, regex, triggers in self._rules:
+            if any(trigger in lowered for trigger in triggers):
+                for match in regex.finditer(text):
+                    yield match.start(), name, match
+
+    def scan(self, text):
+        if len(text) > MEMO_LENGTH:
+            return self._scan(text)[0]
+        memo = self._memo.get(text)
+        if memo is None:
+            if len(self._memo) >= MAX_MEMO:
+                self._memo.clear()
+            memo = self._memo[text] = self._scan(text)
+        else:
+            for name in memo[1]:
+                self.hits[name] += 1
+        return memo[0]
+
+    def _scan(self, text):
+        # Returns the redacted text and the names of the patterns that hit
+        lowered = text.lower()
+        if len(lowered) == len(text):
+            found = sorted(self._candidates(text, lowered), key=lambda f: f[0])
+        else:
+            found = sorted(self._fallback(text, lowered), key=lambda f: f[0])
+        if not found:
+            return text, ()
+        pieces = []
+        names = []
+        position = 0
+        for start, name, match in found:
+            if start < position:
+                continue
+            self.hits[name] += 1
+            names.append(name)
+            if "value" in match.re.groupindex and match.start("value") >= 0:
+                start, end = match.span("value")
+            else:
+                end = match.end()
+            pieces.append(text[position:start])
+            pieces.append(REDACTED)
+            position = end
+        pieces.append(text[position:])
+        return "".join(pieces), tuple(names)
+
+
+class Redactor:
+    # Key rules are compiled once and the decision for each key is
+    # memoized, since the same keys repeat across thousands of records
+    def __init__(self, redact=True, anonymize=False, scan=True):
+        self.redact = redact
+        self.anonymize = anonymize
+        # With redact, secrets inside string values are found by content
+        self.scanner = SecretScanner() if redact and scan else None
+        self._sensitive = _words(SENSITIVE_KEYS)
+        self._personal = _words(ANONYMIZE_KEYS)
+        self._decisions = {}
+
+    def decide(self, key):
+        # Returns the replacement for the key's value, or None to keep it
+        decision = self._decisions.get(key, _UNSEEN)
+        if decision is _UNSEEN:
+            lowered = key.lower() if isinstance(key, str) else str(key)
+            if self.redact and self._sensitive.search(lowered):
+                decision = REDACTED
+            elif self.anonymize and self._personal.search(lowered):
+                decision = "[ANONYMIZED]"
+            else:
+                decision = None
+            if len(self._decisions) >= MAX_MEMO:
+                self._decisions.clear()
+            self._decisions[key] = decision
+        return decision
+
+    def text(self, value):
+        if self.scanner:
+            value = self.scanner.scan(value)
+        if self.anonymize:
+            value = anonymize_text(value)
+        return value
+
+    def section(self, name, data):
+        # Sections are written one at a time, but their names are still keys
+        # of the snapshot, e.g. the whole users section is anonymized
+        decision = self.decide(name)
+        return decision if decision is not None else self.apply(data)
+
+    def apply(self, node):
+        # Redacts in place with an explicit stack, so no copy of the tree is
+        # built and deep nesting cannot hit the recursion limit
+        scrub = self.anonymize or self.scanner is not None
+        if isinstance(node, str):
+            return self.text(node) if scrub else node
+        decide = self.decide
+        stack = [node]
+        while stack:
+            container = stack.pop()
+            if isinstance(container, dict):
+                for key, value in container.items():
+                    decision = decide(key)
+                    if decision is not None:
+                        container[key] = decision
+                    elif isinstance(value, (dict, list)):
+                        stack.append(value)
+                    elif scrub and isinstance(value, str):
+                        container[key] = self.text(value)
+            elif isinstance(container, list):
+                for i, value in enumerate(container):
+                    if isinstance(value, (dict, list)):
+                        stack.append(value)
+                    elif scrub and isinstance(value, str):
+                        container[i] = self.text(value)
+        return node
 
-def redact_snapshot(snapshot, redact=True, anonymize=False):
-    def recursive_redact(d):
-        if isinstance(d, dict):
-            return {
-                k: (
-                    "[REDACTED]"
-                    if redact and any(s in k.lower() for s in SENSITIVE_KEYS)
-                    else (
-                        "[ANONYMIZED]"
-                        if anonymize and any(a in k.lower() for a in ANONYMIZE_KEYS)
-                        else recursive_redact(v)
-                    )
-                )
-                for k, v in d.items()
-            }
-        elif isinstance(d, list):
-            return [recursive_redact(x) for x in d]
-        elif isinstance(d, str) and anonymize:
-            # Simple anonymization for IPs, hostnames, etc.
-            d = re.sub(r"\b(?:\d{1,3}\.){3}\d{1,3}\b", "[ANONYMIZED_IP]", d)
-            d = re.sub(
-                r"\b[a-fA-F0-9]{2}(?::[a-fA-F0-9]{2}){5}\b", "[ANONYMIZED_MAC]", d
-            )
-            return d
-        return d
-
-    return recursive_redact(snapshot)
@@ -0,0 +1,141 @@
+import queue
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, TimeoutError, wait
+
+from utils.shell import Deadline, set_deadline
+
+DEFAULT_COLLECTOR_TIMEOUT = 60.0
+# Start order by declared cost (plugins may declare one), so that with a
+# limited --jobs the slow collectors are not left for last
+COST_ORDER = {"expensive": 0, "normal": 1, "cheap": 2}
+
+
+def _run_one(module, options, deadline):
+    deadline.start()
+    set_deadline(deadline)
+    try:
+        return module.collect(**options)
+    except Exception as e:
+        return {"error": str(e)}
+    finally:
+        set_deadline(None)
+
+
+def _worker(jobs):
+    while True:
+        item = jobs.get()
+        if item is None:
+            return
+        future, module, options, deadline = item
+        if not future.set_running_or_notify_cancel():
+            continue
+        future.set_result(_run_one(module, options, deadline))
+        # A replacement took over while this collector overran its deadline
+        if deadline.expired:
+            return
+
+
+def _wait(future, deadline):
+    while True:
+        remaining = deadline.remaining()
+        if remaining is not None and remaining <= 0:
+            return False
+        if deadline.started is None:
+            # Still queued: only the run deadline applies, but poll so the
+            # collector deadline is picked up once a worker starts it
+            remaining = 0.1 if remaining is None else min(remaining, 0.1)
+        try:
+            future.result(timeout=remaining)
+            return True
+        except TimeoutError:
+            continue
+
+
+def _timed_out(name, future, deadline, start_worker):
+    deadline.expire()
+    if not future.cancel():
+        # The collector is still running (e.g. stuck in Python code, which
+        # cannot be killed) and holds its worker; start another so that the
+        # collectors still queued behind it are not held up
+        start_worker()
+    return name, {"timed_out": True, "elapsed": round(deadline.elapsed(), 3)}
+
+
+def _iter_completed(futures, start_worker):
+    pending = futures
+    while pending:
+        waits = [d.remaining() for _, _, d in pending if d.started is not None]
+        waits = [w for w in waits if w is not None]
+        if any(d.started is None for _, _, d in pending):
+            waits.append(0.1)
+        wait(
+            [f for _, f, _ in pending],
+            timeout=max(0, min(waits)) if waits else None,
+            return_when=FIRST_COMPLETED,
+        )
+        still_pending = []
+        for name, future, deadline in pending:
+            remaining = deadline.remaining()
+            if future.done():
+                yield name, future.result()
+            elif remaining is not None and remaining <= 0:
+                yield _timed_out(name, future, deadline, start_worker)
+            else:
+                still_pending.append((name, future, deadline))
+        pending = still_pending
+
+
+def iter_collect(
+    tasks,
+    jobs=None,
+    timeout=None,
+    collector_timeouts=None,
+    options=None,
+    ordered=True,
+):
+    # Collectors mostly wait on subprocesses, so start them all at once.
+    # Results are yielded in task order regardless of which one finishes
+    # first, or as each one completes when ``ordered`` is false.
+    # Workers are daemon threads so a collector that overruns its deadline
+    # cannot keep the process alive after the snapshot is written.
+    tasks = list(tasks)
+    if not tasks:
+        return
+    collector_timeouts = collector_timeouts or {}
+    options = options or {}
+    default_timeout = collector_timeouts.get("*", DEFAULT_COLLECTOR_TIMEOUT)
+    until = time.monotonic() + timeout if timeout else None
+
+    pending = queue.Queue()
+
+    def start_worker():
+        threading.Thread(target=_worker, args=(pending,), daemon=True).start()
+
+    workers = min(jobs or len(tasks), len(tasks))
+    for _ in range(workers):
+        start_worker()
+
+    futures = []
+    queued = []
+    for name, module in tasks:
+        deadline = Deadline(collector_timeouts.get(name, default_timeout), until)
+        future = Future()
+        cost = COST_ORDER.get(getattr(module, "cost", None), 1)
+        queued.append((cost, (future, module, options.get(name, {}), deadline)))
+        futures.append((name, future, deadline))
+    # sorted() is stable, so equal costs keep task order
+    for _, item in sorted(queued, key=lambda q: q[0]):
+        pending.put(item)
+    for _ in range(workers):
+        pending.put(None)
+
+    if not ordered:
+        yield from _iter_completed(futures, start_worker)
+        return
+    for name, future, deadline in futures:
+        if _wait(future, deadline):
+            yield name, future.result()
+        else:
+            yield _timed_out(name, future, deadline, start_worker)
+
@@ -0,0 +1,206 @@
+import os
+import signal
+import subprocess
+import threading
+import time
+
+_local = threading.local()
+_cache = None
+
+
+class Deadline:
+    def __init__(self, seconds=None, until=None):
+        # ``seconds`` counts from start(), ``until`` is an absolute
+        # time.monotonic() value shared by the whole run
+        self.seconds = seconds
+        self.until = until
+        self.started = None
+        self.expired = False
+        self._procs = set()
+        self._lock = threading.Lock()
+
+    def start(self):
+        self.started = time.monotonic()
+
+    def expires(self):
+        ends = [self.until] if self.until is not None else []
+        if self.started is not None and self.seconds is not None:
+            ends.append(self.started + self.seconds)
+        return min(ends) if ends else None
+
+    def remaining(self):
+        if self.expired:
+            return 0
+        expires = self.expires()
+        return None if expires is None else expires - time.monotonic()
+
+    def elapsed(self):
+        if self.started is None:
+            return 0.0
+        return time.monotonic() - self.started
+
+    def track(self, proc):
+        with self._lock:
+            if self.expired:
+                _kill(proc)
+            self._procs.add(proc)
+
+    def untrack(self, proc):
+        with self._lock:
+            self._procs.discard(proc)
+
+    def expire(self):
+        with self._lock:
+            self.expired = True
+            procs = list(self._procs)
+        for proc in procs:
+            _kill(proc)
+
+
+def set_deadline(deadline):
+    _local.deadline = deadline
+
+
+def current_deadline():
+    return getattr(_local, "deadline", None)
+
+
+def _kill(proc):
+    # Commands run in their own session, so this also takes out any children
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+class _Probe:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class ProbeCache:
+    # Memoizes command output and file reads for the duration of one
+    # snapshot. Concurrent callers for the same key wait for the probe that
+    # is already in flight instead of starting their own.
+    def __init__(self):
+        self._probes = {}
+        self._lock = threading.Lock()
+        self.hits = {}
+        self.misses = 0
+
+    def get(self, key, fn):
+        while True:
+            with self._lock:
+                probe = self._probes.get(key)
+                owner = probe is None
+                if owner:
+                    probe = self._probes[key] = _Probe()
+                    self.misses += 1
+                else:
+                    self.hits[key] = self.hits.get(key, 0) + 1
+            if owner:
+                try:
+                    probe.result = fn()
+                except subprocess.TimeoutExpired as e:
+                    # Cut short by the owner's deadline: let the next caller
+                    # retry with its own instead of inheriting the failure
+                    with self._lock:
+                        del self._probes[key]
+                    probe.error = e
+                    probe.done.set()
+                    raise
+                except Exception as e:
+                    probe.error = e
+                probe.done.set()
+            else:
+                deadline = current_deadline()
+                remaining = deadline.remaining() if deadline is not None else None
+                if remaining is not None and remaining <= 0:
+                    raise subprocess.TimeoutExpired(key, 0)
+                if not probe.done.wait(remaining):
+                    raise subprocess.TimeoutExpired(key, remaining)
+                if isinstance(probe.error, subprocess.TimeoutExpired):
+                    continue
+            if probe.error is not None:
+                raise probe.error
+            return probe.result
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": sum(self.hits.values()),
+                "misses": self.misses,
+                "by_probe": {
+                    " ".join(key[1]) if key[0] == "run" else key[1]: count
+                    for key, count in self.hits.items()
+                },
+            }
+
+
+def start_probe_cache():
+    global _cache
+    _cache = ProbeCache()
+    return _cache
+
+
+def stop_probe_cache():
+    global _cache
+    cache, _cache = _cache, None
+    return cache
+
+
+def read_file(path):
+    def read():
+        with open(path) as f:
+            return f.read()
+
+    if _cache is None:
+        return read()
+    return _cache.get(("read", path), read)
+
+
+def run(args, shell=False, timeout=None):
+    if _cache is None:
+        return _run(args, shell, timeout)
+    key = ("run", tuple(args) if not isinstance(args, str) else (args,), shell)
+    return _cache.get(key, lambda: _run(args, shell, timeout))
+
+
+def _run(args, shell=False, timeout=None):
+    deadline = current_deadline()
+    if deadline is not None:
+        remaining = deadline.remaining()
+        if remaining is not None:
+            if remaining <= 0:
+                raise subprocess.TimeoutExpired(args, 0)
+            timeout = remaining if timeout is None else min(timeout, remaining)
+
+    proc = subprocess.Popen(
+        args,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+        shell=shell,
+        start_new_session=True,
+    )
+    if deadline is not None:
+        deadline.track(proc)
+    try:
+        stdout, stderr = proc.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        _kill(proc)
+        try:
+            # A process stuck in uninterruptible sleep (e.g. on a dead NFS
+            # mount) cannot be reaped; give up on it rather than hang here
+            proc.communicate(timeout=1)
+        except subprocess.TimeoutExpired:
+            pass
+        raise
+    finally:
+        if deadline is not None:
+            deadline.untrack(proc)
+    if deadline is not None and deadline.expired:
+        raise subprocess.TimeoutExpired(args, timeout or 0, stdout, stderr)
+    return subprocess.CompletedProcess(args, proc.returncode, stdout, stderr)
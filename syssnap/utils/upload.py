@@ -1,16 +1,266 @@
+import fcntl
+import json
+import os
+import random
+import sys
+import time
+import zlib
 import requests
+from requests.adapters import HTTPAdapter
+from utils.paths import cache_dir
 
+CHUNK_SIZE = 64 * 1024
+RETRIES = 3
+BACKOFF = 0.5
+MAX_DELAY = 30.0
+TIMEOUT = (5, 30)
+BATCH_SIZE = 20
+SPOOL_LIMIT = 200
+RETRY_STATUS = {408, 425, 429, 500, 502, 503, 504}
+
+CONTENT_TYPES = {
+    "json": "application/json",
+    "ndjson": "application/x-ndjson",
+    "yaml": "application/x-yaml",
+    "txt": "text/plain",
+}
+
+
+def content_type(fmt):
+    return CONTENT_TYPES.get(fmt, "application/octet-stream")
+
+
+def _log(message):
+    print(message, file=sys.stderr)
+
+
+def _open_private(path, mode):
+    # Spooled bodies are the snapshot itself, so only the user may read them
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    return os.fdopen(fd, mode)
+
+
+class SpoolEntry:
+    # Write-only stream that stores one upload body in the spool, gzipped
+    # when ``encode`` is set. It only becomes visible to drain() once closed.
+    def __init__(self, spool, name, meta, encode):
+        self.spool = spool
+        self.name = name
+        self.meta = meta
+        self._part = spool.body_path(name) + ".part"
+        self._file = _open_private(self._part, "wb")
+        self._gzip = zlib.compressobj(6, zlib.DEFLATED, 31) if encode else None
+
+    def write(self, data):
+        if self._gzip:
+            data = self._gzip.compress(data)
+        self._file.write(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if self._gzip:
+            self._file.write(self._gzip.flush())
+        self._file.close()
+        os.replace(self._part, self.spool.body_path(self.name))
+        meta_path = self.spool.meta_path(self.name)
+        with _open_private(meta_path + ".part", "w") as f:
+            json.dump(self.meta, f)
+        os.replace(meta_path + ".part", meta_path)
+
+    def discard(self):
+        self._file.close()
+        try:
+            os.remove(self._part)
+        except FileNotFoundError:
+            pass
+
+
+class Spool:
+    # On-disk queue of upload bodies: <name>.body holds the bytes exactly as
+    # they go on the wire and <name>.json the URL and headers. Names sort by
+    # creation time.
+    def __init__(self, path=None):
+        self.path = path or cache_dir("spool")
+        os.makedirs(self.path, mode=0o700, exist_ok=True)
+
+    def body_path(self, name):
+        return os.path.join(self.path, name + ".body")
+
+    def meta_path(self, name):
+        return os.path.join(self.path, name + ".json")
+
+    def create(self, url, content_type, encode=True):
+        name = f"{time.time_ns()}-{os.getpid()}"
+        meta = {
+            "url": url,
+            "content_type": content_type,
+            "content_encoding": "gzip" if encode else None,
+            "created": time.time(),
+        }
+        return SpoolEntry(self, name, meta, encode)
+
+    def pending(self):
+        return sorted(
+            fname[:-5]
+            for fname in os.listdir(self.path)
+            if fname.endswith(".json")
+            and os.path.exists(self.body_path(fname[:-5]))
+        )
+
+    def load(self, name):
+        with open(self.meta_path(name)) as f:
+            return json.load(f)
+
+    def remove(self, name):
+        for path in (self.body_path(name), self.meta_path(name)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def trim(self, limit=SPOOL_LIMIT):
+        # Drop the oldest entries so an endpoint that stays down cannot fill
+        # the disk
+        names = self.pending()
+        for name in names[: max(0, len(names) - limit)]:
+            self.remove(name)
+        return max(0, len(names) - limit)
+
+    def lock(self):
+        # Non-blocking exclusive lock, so two runs never send the same entry;
+        # returns None when another run holds it
+        f = open(os.path.join(self.path, ".lock"), "w")
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            f.close()
+            return None
+        return f
+
+
+def _chunks(path):
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                return
+            yield chunk
+
+
+class Uploader:
+    # One pooled session, so a run that drains several spooled snapshots to
+    # the same endpoint reuses its connection. Bodies are streamed from the
+    # spool with chunked transfer encoding.
+    def __init__(self, retries=RETRIES, backoff=BACKOFF, timeout=TIMEOUT):
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=4)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def send(self, body_path, meta):
+        # Returns ("sent" | "rejected" | "failed", message). Connection
+        # errors, timeouts and transient statuses are retried with
+        # exponential backoff; other HTTP errors are not.
+        headers = {"Content-Type": meta["content_type"]}
+        if meta.get("content_encoding"):
+            headers["Content-Encoding"] = meta["content_encoding"]
+        message = ""
+        for attempt in range(self.retries + 1):
+            retry_after = None
+            try:
+                response = self.session.post(
+                    meta["url"],
+                    data=_chunks(body_path),
+                    headers=headers,
+                    timeout=self.timeout,
+                )
+            except requests.RequestException as e:
+                message = str(e)
+            else:
+                if response.status_code < 300:
+                    return "sent", f"{response.status_code}"
+                message = f"{response.status_code} {response.text[:200]}"
+                if response.status_code not in RETRY_STATUS:
+                    return "rejected", message
+                retry_after = response.headers.get("Retry-After")
+            if attempt < self.retries:
+                time.sleep(self._delay(attempt, retry_after))
+        return "failed", message
+
+    def _delay(self, attempt, retry_after):
+        if retry_after and retry_after.isdigit():
+            return min(MAX_DELAY, float(retry_after))
+        delay = self.backoff * (2 ** attempt)
+        return min(MAX_DELAY, delay + random.uniform(0, self.backoff))
+
+    def close(self):
+        self.session.close()
+
+
+def drain(spool, uploader, limit=None):
+    # Sends spooled snapshots oldest first and stops at the first one that
+    # fails, leaving it and the rest queued. Returns (sent, still pending).
+    lock = spool.lock()
+    if lock is None:
+        _log("Spool is being drained by another run; skipping.")
+        return 0, len(spool.pending())
+    sent = 0
+    try:
+        pending = spool.pending()
+        for name in pending[:limit]:
+            meta = spool.load(name)
+            status, message = uploader.send(spool.body_path(name), meta)
+            if status == "failed":
+                _log(f"Upload of spooled snapshot {name} failed: {message}")
+                break
+            if status == "rejected":
+                _log(f"Spooled snapshot {name} rejected, dropping it: {message}")
+            else:
+                sent += 1
+            spool.remove(name)
+    finally:
+        lock.close()
+    return sent, len(spool.pending())
+
+
+def deliver(spool, name, uploader):
+    # Sends a just-spooled snapshot. If the endpoint is unreachable it stays
+    # in the spool; otherwise earlier spooled snapshots are sent after it.
+    # While another run drains the spool the snapshot is left for it (or
+    # the next drain), since that run may pick up this entry as well.
+    lock = spool.lock()
+    if lock is None:
+        _log(
+            "Spool is being drained by another run; snapshot spooled to "
+            f"{spool.body_path(name)} (send later with --drain-spool)"
+        )
+        return False
+    try:
+        status, message = uploader.send(spool.body_path(name), spool.load(name))
+        if status == "failed":
+            dropped = spool.trim()
+            if dropped:
+                _log(f"Spool full, dropped {dropped} oldest snapshot(s).")
+            _log(
+                f"Upload failed: {message}; spooled to {spool.body_path(name)} "
+                "(send later with --drain-spool)"
+            )
+            return False
+        spool.remove(name)
+    finally:
+        lock.close()
+    if status == "rejected":
+        _log(f"Upload failed: {message}")
+        return False
+    _log("Upload successful.")
+    if spool.pending():
+        sent, left = drain(spool, uploader, limit=BATCH_SIZE)
+        if sent or left:
+            _log(f"Sent {sent} spooled snapshot(s), {left} still queued.")
+    return True
 
-def upload_snapshot(data, url, fmt):
-    headers = {
-        "Content-Type": {
-            "json": "application/json",
-            "yaml": "application/x-yaml",
-            "txt": "text/plain",
-        }.get(fmt, "application/octet-stream")
-    }
-    response = requests.post(url, data=data, headers=headers)
-    if response.status_code == 200:
-        print("Upload successful.")
-    else:
-        print(f"Upload failed: {response.status_code} {response.text}")